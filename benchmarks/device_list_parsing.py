@@ -0,0 +1,106 @@
+"""Compare reading thermostats from a Fritzbox device list.
+
+Parses an emulated `getdevicelistinfos` response of a mixed household, once
+the way pyfritzhome does (all devices as full objects, thermostats picked
+afterwards) and once with the lean reader, timing both and measuring their
+peak memory. Run from the repository root like:
+
+    uv run python -m benchmarks.device_list_parsing --devices 200
+"""
+
+import argparse
+import statistics
+import time
+import tracemalloc
+
+from benchmarks.utils import print_results
+from benchmarks.utils import setup_django
+
+def build_device_list(device_count: int) -> str:
+    """Return a device list of a home, a third of it thermostats."""
+    from fritzbox_thermostat_triggers.triggers.emulator import FritzboxEmulator
+
+    group_count = device_count // 6
+    thermostat_count = device_count // 3
+    emulator = FritzboxEmulator(
+        thermostat_count=thermostat_count,
+        group_count=group_count,
+        other_device_count=device_count - thermostat_count - group_count,
+    )
+    return emulator.render_device_list()
+
+
+def read_with_pyfritzhome(plain: str) -> list:
+    from pyfritzhome import Fritzhome
+
+    fritzbox = Fritzhome("fritz.box", "user", "password")
+    fritzbox._aha_request = lambda cmd, **kwargs: plain
+    fritzbox.update_devices()
+    return [device for device in fritzbox.get_devices() if device.has_thermostat]
+
+
+def read_leanly(plain: str) -> list:
+    from fritzbox_thermostat_triggers.triggers.fritzbox import DEVICE_LIST_CHUNK_SIZE
+    from fritzbox_thermostat_triggers.triggers.fritzbox import parse_thermostat_devices
+
+    # As the body arrives from the connection.
+    content = plain.encode()
+    return parse_thermostat_devices(
+        content[start : start + DEVICE_LIST_CHUNK_SIZE]
+        for start in range(0, len(content), DEVICE_LIST_CHUNK_SIZE)
+    )
+
+
+def measure_parsing(function, plain: str, repeat: int) -> dict:
+    durations = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        devices = function(plain)
+        durations.append(time.perf_counter() - started_at)
+
+    tracemalloc.start()
+    devices = function(plain)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "median_ms": round(statistics.median(durations) * 1000, 3),
+        "min_ms": round(min(durations) * 1000, 3),
+        "peak_kib": round(peak / 1024, 1),
+        "thermostats": len(devices),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", action="store_true", default=False)
+    args = parser.parse_args()
+
+    setup_django()
+    plain = build_device_list(args.devices)
+
+    # Both need to agree on what they found, or the numbers mean nothing.
+    expected = {
+        (device.ain, device.name, device.target_temperature)
+        for device in read_with_pyfritzhome(plain)
+    }
+    actual = {
+        (device.ain, device.name, device.target_temperature)
+        for device in read_leanly(plain)
+    }
+    assert expected == actual, expected ^ actual
+
+    print_results(
+        {
+            "devices": args.devices,
+            "payload_kib": round(len(plain) / 1024, 1),
+            "pyfritzhome": measure_parsing(read_with_pyfritzhome, plain, args.repeat),
+            "lean": measure_parsing(read_leanly, plain, args.repeat),
+        },
+        as_json=args.json,
+    )
+
+
+if __name__ == "__main__":
+    main()
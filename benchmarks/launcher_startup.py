@@ -0,0 +1,160 @@
+"""Compare the startup of a cron run when no Trigger is due.
+
+Times whole processes, as cron would start them: once the
+sync_and_trigger_thermostats command the way manage.py runs it, and once
+the launcher, which only reads the schedule file. The lookup in the
+schedule file is also timed on its own. Run from the repository root like:
+
+    uv run python -m benchmarks.launcher_startup --triggers 1000
+"""
+
+from datetime import timedelta
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.utils import BASE_DIR
+from benchmarks.utils import get_git_revision
+from benchmarks.utils import print_results
+from benchmarks.utils import setup_benchmark_database
+from benchmarks.utils import setup_django
+from benchmarks.utils import teardown_benchmark_database
+
+# Like manage.py, but against the benchmark database.
+RUN_COMMAND = """
+import os, sys
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fritzbox_thermostat_triggers.settings")
+from django.conf import settings
+settings.DATABASES["default"]["NAME"] = sys.argv[1]
+from django.core.management import execute_from_command_line
+execute_from_command_line(["manage.py", "sync_and_trigger_thermostats"])
+"""
+
+
+def seed(thermostat_count: int, trigger_count: int):
+    """Create Triggers all around the week, but none due right now."""
+    from django.utils import timezone
+
+    from fritzbox_thermostat_triggers.triggers.models import WEEKDAY_FIELD_NAMES
+    from fritzbox_thermostat_triggers.triggers.models import Thermostat
+    from fritzbox_thermostat_triggers.triggers.models import Trigger
+
+    thermostats = Thermostat.objects.bulk_create(
+        Thermostat(ain=f"11959 {n:07d}", name=f"Thermostat {n}")
+        for n in range(thermostat_count)
+    )
+    now = timezone.localtime()
+    triggers = []
+    for i in range(trigger_count):
+        recurring = i % 2 == 0
+        trigger = Trigger(
+            thermostat=random.choice(thermostats),
+            # Keeps the time of day away from now, on any day of the week.
+            time=now + timedelta(minutes=random.randrange(10, 24 * 60 - 10)),
+            temperature=random.choice((0, 18, 21, 23)),
+            **{
+                field: recurring and random.random() < 0.6
+                for field in WEEKDAY_FIELD_NAMES
+            },
+        )
+        trigger.next_fire_at = trigger.compute_next_fire_at(now)
+        triggers.append(trigger)
+    Trigger.objects.bulk_create(triggers)
+
+
+def measure_process(args: list, env: dict, repeat: int) -> dict:
+    durations = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        subprocess.run(args, check=True, cwd=BASE_DIR, env=env)
+        durations.append(time.perf_counter() - started_at)
+    return {
+        "median_ms": round(statistics.median(durations) * 1000, 1),
+        "min_ms": round(min(durations) * 1000, 1),
+    }
+
+
+def measure_lookup(path: str, repeat: int) -> dict:
+    from fritzbox_thermostat_triggers.triggers.schedule_file import is_due
+
+    now = time.time()
+    durations = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        due = is_due(path, start=now - 60, end=now)
+        durations.append(time.perf_counter() - started_at)
+    assert not due, "Nothing should be due in this benchmark"
+    return {
+        "median_us": round(statistics.median(durations) * 1_000_000, 1),
+        "min_us": round(min(durations) * 1_000_000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--thermostats", type=int, default=20)
+    parser.add_argument("--triggers", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", default=False)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    setup_django()
+    from django.conf import settings
+
+    from fritzbox_thermostat_triggers.triggers.schedule import write_schedule_file
+
+    directory = tempfile.mkdtemp()
+    env = {
+        **os.environ,
+        "METRICS_STATE_PATH": f"{directory}/metrics.json",
+        "TRIGGER_SCHEDULE_PATH": f"{directory}/schedule.bin",
+        "TRIGGER_PROCESSED_UNTIL_PATH": f"{directory}/processed_until",
+        "TRIGGER_RUN_LOCK_PATH": f"{directory}/run.lock",
+        "FRITZBOX_CIRCUIT_PATH": f"{directory}/circuit.json",
+    }
+    settings.TRIGGER_SCHEDULE_PATH = env["TRIGGER_SCHEDULE_PATH"]
+
+    path = setup_benchmark_database("launcher_startup")
+    try:
+        seed(args.thermostats, args.triggers)
+        write_schedule_file()
+        results = {
+            "interpreter": measure_process(
+                [sys.executable, "-c", "pass"], env, args.repeat
+            ),
+            "command": measure_process(
+                [sys.executable, "-c", RUN_COMMAND, path], env, args.repeat
+            ),
+            "launcher": measure_process(
+                [sys.executable, "-m", "fritzbox_thermostat_triggers.launcher"],
+                env,
+                args.repeat,
+            ),
+            "schedule_lookup": measure_lookup(
+                settings.TRIGGER_SCHEDULE_PATH, args.repeat * 100
+            ),
+        }
+        print_results(
+            {
+                "revision": get_git_revision(),
+                "parameters": {
+                    key: value for key, value in vars(args).items() if key != "json"
+                },
+                "schedule_file_bytes": os.path.getsize(settings.TRIGGER_SCHEDULE_PATH),
+                "results": results,
+            },
+            as_json=args.json,
+        )
+    finally:
+        teardown_benchmark_database(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Compare ThermostatLog lookups with and without their indexes.
+
+Seeds a large number of logs into a temporary database, then times the
+lookups once with the indexes of ThermostatLog dropped and once with them
+in place. Run from the repository root like:
+
+    uv run python -m benchmarks.log_indexes --rows 1000000
+"""
+
+import argparse
+
+from benchmarks.utils import measure
+from benchmarks.utils import print_results
+from benchmarks.utils import seed_logs
+from benchmarks.utils import setup_benchmark_database
+from benchmarks.utils import setup_django
+from benchmarks.utils import teardown_benchmark_database
+
+
+def seed(rows: int, thermostat_count: int, trigger_count: int) -> list:
+    from django.utils import timezone
+
+    from fritzbox_thermostat_triggers.triggers.models import Thermostat
+    from fritzbox_thermostat_triggers.triggers.models import Trigger
+
+    now = timezone.now()
+    thermostats = Thermostat.objects.bulk_create(
+        Thermostat(ain=f"11962 {i:07d}", name=f"Room {i}")
+        for i in range(thermostat_count)
+    )
+    triggers = Trigger.objects.bulk_create(
+        Trigger(
+            thermostat=thermostats[i % thermostat_count],
+            time=now,
+            temperature=20,
+            recur_on_monday=True,
+        )
+        for i in range(trigger_count)
+    )
+    seed_logs(triggers, rows)
+    return triggers
+
+
+def get_lookups(triggers: list) -> dict:
+    from django.contrib.auth.models import User
+    from django.test import RequestFactory
+
+    from fritzbox_thermostat_triggers.triggers.views import list_logs
+
+    user = User.objects.create_superuser("benchmark", password="benchmark")
+
+    def render_logs_page(query: str = ""):
+        request = RequestFactory().get(f"/logs/{query}")
+        request.user = user
+        request.session = {}
+        request.htmx = True  # Only render the rows.
+        list_logs(request)
+
+    return {
+        "list_logs": render_logs_page,
+        "list_logs_of_trigger": lambda: render_logs_page(f"?trigger={triggers[0].id}"),
+        "list_logs_of_thermostat": lambda: render_logs_page(
+            f"?thermostat={triggers[0].thermostat_id}"
+        ),
+        "list_logs_without_effect": lambda: render_logs_page("?no_op=1"),
+        "list_logs_with_effect": lambda: render_logs_page("?no_op=0"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--thermostats", type=int, default=10)
+    parser.add_argument("--triggers", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", default=False)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+
+    from fritzbox_thermostat_triggers.triggers.models import ThermostatLog
+
+    path = setup_benchmark_database("log_indexes")
+    try:
+        triggers = seed(args.rows, args.thermostats, args.triggers)
+        lookups = get_lookups(triggers)
+        indexes = ThermostatLog._meta.indexes
+
+        with connection.schema_editor() as schema_editor:
+            for index in indexes:
+                schema_editor.remove_index(ThermostatLog, index)
+        before = {
+            name: measure(lookup, args.repeat) for name, lookup in lookups.items()
+        }
+
+        with connection.schema_editor() as schema_editor:
+            for index in indexes:
+                schema_editor.add_index(ThermostatLog, index)
+        after = {
+            name: measure(lookup, args.repeat) for name, lookup in lookups.items()
+        }
+
+        print_results(
+            {
+                "rows": args.rows,
+                "without_indexes": before,
+                "with_indexes": after,
+            },
+            as_json=args.json,
+        )
+    finally:
+        teardown_benchmark_database(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Time the trigger pipeline as data grows.
+
+Seeds Thermostats, one-off and recurring Triggers and ThermostatLogs into a
+temporary database, then times finding due Triggers, a whole run of
+sync_and_trigger_thermostats against an emulated Fritzbox and rendering the
+triggers and logs pages. Results include the query counts and the current
+git revision, print them as JSON to compare between commits:
+
+    uv run python -m benchmarks.trigger_pipeline --json > before.json
+"""
+
+from datetime import timedelta
+import argparse
+import random
+import tempfile
+import threading
+
+from benchmarks.utils import get_git_revision
+from benchmarks.utils import measure
+from benchmarks.utils import print_results
+from benchmarks.utils import seed_logs
+from benchmarks.utils import setup_benchmark_database
+from benchmarks.utils import setup_django
+from benchmarks.utils import teardown_benchmark_database
+
+
+def seed(emulator, trigger_count: int, due_count: int, log_count: int):
+    from django.utils import timezone
+
+    from fritzbox_thermostat_triggers.triggers.models import WEEKDAY_FIELD_NAMES
+    from fritzbox_thermostat_triggers.triggers.models import Thermostat
+    from fritzbox_thermostat_triggers.triggers.models import Trigger
+
+    thermostats = Thermostat.objects.bulk_create(
+        Thermostat(ain=device.ain, name=device.name)
+        for device in emulator.devices.values()
+        if device.has_thermostat
+    )
+
+    now = timezone.localtime()
+    triggers = []
+    for i in range(trigger_count):
+        # Every other Trigger recurs, the due ones fire right now while the
+        # others are spread over the coming week.
+        recurring = i % 2 == 0
+        time = now
+        if i >= due_count:
+            time += timedelta(minutes=random.randrange(1, 7 * 24 * 60))
+        trigger = Trigger(
+            thermostat=random.choice(thermostats),
+            time=time,
+            temperature=random.choice((0, 18, 21, 23)),
+            **{
+                field: recurring and random.random() < 0.6
+                for field in WEEKDAY_FIELD_NAMES
+            },
+        )
+        if recurring and i < due_count:
+            setattr(trigger, WEEKDAY_FIELD_NAMES[now.weekday()], True)
+        # Not set by bulk_create, which skips save().
+        trigger.next_fire_at = trigger.compute_next_fire_at(now)
+        triggers.append(trigger)
+    triggers = Trigger.objects.bulk_create(triggers)
+    seed_logs(triggers, log_count)
+
+
+def rolled_back(function):
+    """Undo what function changed, so each repetition starts the same."""
+    from django.db import transaction
+
+    def wrapper():
+        with transaction.atomic():
+            function()
+            transaction.set_rollback(True)
+
+    return wrapper
+
+
+def get_paths() -> dict:
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.test import RequestFactory
+    from django.utils import timezone
+
+    from fritzbox_thermostat_triggers.triggers.management.commands.sync_and_trigger_thermostats import get_soon_non_recurring_triggers  # noqa
+    from fritzbox_thermostat_triggers.triggers.management.commands.sync_and_trigger_thermostats import get_soon_recurring_triggers  # noqa
+    from fritzbox_thermostat_triggers.triggers.models import Thermostat
+    from fritzbox_thermostat_triggers.triggers.views import list_logs
+    from fritzbox_thermostat_triggers.triggers.views import list_triggers
+
+    user = User.objects.create_superuser("benchmark", password="benchmark")
+
+    def render(view, path: str):
+        request = RequestFactory().get(path)
+        request.user = user
+        request.session = {}
+        request.htmx = False
+        view(request)
+
+    def get_window() -> tuple:
+        now = timezone.localtime()
+        return now - timedelta(minutes=1), now
+
+    def run_command():
+        call_command("sync_and_trigger_thermostats", minutes=1)
+
+    def run_command_with_warm_cache():
+        # As if all target temperatures had just been read.
+        Thermostat.objects.update(
+            target_temperature=21, target_temperature_read_at=timezone.now()
+        )
+        run_command()
+
+    return {
+        "get_soon_recurring_triggers": lambda: get_soon_recurring_triggers(
+            *get_window()
+        ),
+        "get_soon_non_recurring_triggers": lambda: get_soon_non_recurring_triggers(
+            *get_window()
+        ),
+        "command_handle": rolled_back(run_command),
+        "command_handle_warm_cache": rolled_back(run_command_with_warm_cache),
+        "list_triggers": lambda: render(list_triggers, "/triggers/"),
+        "list_logs": lambda: render(list_logs, "/logs/"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--thermostats", type=int, default=20)
+    parser.add_argument("--triggers", type=int, default=1000)
+    parser.add_argument("--due", type=int, default=20)
+    parser.add_argument("--logs", type=int, default=100_000)
+    parser.add_argument(
+        "--latency-ms", type=int, default=0, help="Per request to the Fritzbox"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", default=False)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    setup_django()
+    from django.conf import settings
+
+    from fritzbox_thermostat_triggers.triggers.emulator import FritzboxEmulator
+
+    emulator = FritzboxEmulator(
+        thermostat_count=args.thermostats,
+        other_device_count=args.thermostats // 2,
+        latency=args.latency_ms / 1000,
+        seed=args.seed,
+    )
+    server = emulator.make_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    settings.FRITZBOX_HOST = f"http://{host}:{port}"
+    settings.FRITZBOX_USER = emulator.user
+    settings.FRITZBOX_PASSWORD = emulator.password
+    directory = tempfile.mkdtemp()
+    settings.FRITZBOX_SID_CACHE_PATH = f"{directory}/sid.json"
+    # Recorded like in production, but kept out of the real metrics.
+    settings.METRICS_STATE_PATH = f"{directory}/metrics.json"
+    settings.METRICS_TEXTFILE_PATH = ""
+    settings.TRIGGER_PROCESSED_UNTIL_PATH = ""
+    settings.TRIGGER_SCHEDULE_PATH = f"{directory}/schedule.bin"
+    settings.TRIGGER_RUN_LOCK_PATH = f"{directory}/run.lock"
+    settings.FRITZBOX_CIRCUIT_PATH = f"{directory}/circuit.json"
+    settings.PUSHOVER_USER_KEY = ""
+
+    path = setup_benchmark_database("trigger_pipeline")
+    try:
+        seed(emulator, args.triggers, args.due, args.logs)
+        results = {
+            name: measure(function, args.repeat)
+            for name, function in get_paths().items()
+        }
+        print_results(
+            {
+                "revision": get_git_revision(),
+                "parameters": {
+                    key: value for key, value in vars(args).items() if key != "json"
+                },
+                "results": results,
+                "fritzbox_requests": dict(emulator.request_counts),
+            },
+            as_json=args.json,
+        )
+    finally:
+        teardown_benchmark_database(path)
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Shared helpers for the benchmarks in this directory.
+
+Benchmarks run against a throwaway SQLite database (migrated just like the
+real one), so they never touch the data of the app itself.
+"""
+
+from datetime import timedelta
+from pathlib import Path
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django():
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault(
+        "DJANGO_SETTINGS_MODULE", "fritzbox_thermostat_triggers.settings"
+    )
+    import django
+
+    django.setup()
+
+
+def setup_benchmark_database(name: str = "benchmark") -> str:
+    """Create and migrate a temporary database, return its path."""
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    path = os.path.join(tempfile.mkdtemp(), f"{name}.sqlite3")
+    connection.settings_dict["TEST"]["NAME"] = path
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    return path
+
+
+def teardown_benchmark_database(path: str):
+    from django.db import connection
+
+    connection.creation.destroy_test_db(path, verbosity=0)
+
+
+def seed_logs(triggers: list, rows: int):
+    """Insert ThermostatLogs of given Triggers, one every few minutes."""
+    from django.db import connection
+    from django.utils import timezone
+
+    from fritzbox_thermostat_triggers.triggers.models import ThermostatLog
+
+    # Raw inserts are used as bulk_create would override created_at.
+    table = ThermostatLog._meta.db_table
+    sql = (
+        f"INSERT INTO {table} "
+        "(created_at, updated_at, thermostat_id, trigger_id, temperature, no_op, "
+        "suppressed) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s)"
+    )
+    start = timezone.now() - timedelta(minutes=3 * rows)
+    batch = []
+    with connection.cursor() as cursor:
+        for i in range(rows):
+            created_at = start + timedelta(minutes=3 * i)
+            trigger = random.choice(triggers)
+            batch.append(
+                (
+                    created_at,
+                    created_at,
+                    trigger.thermostat_id,
+                    trigger.id,
+                    random.choice((0, 20, 21)),
+                    random.random() < 0.5,
+                    False,
+                )
+            )
+            if len(batch) == 10_000:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+
+def get_git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            cwd=BASE_DIR,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def measure(function, repeat: int = 5) -> dict:
+    """Call function repeatedly, return wall times and its query count."""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    durations = []
+    query_count = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            started_at = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - started_at)
+        query_count = len(context.captured_queries)
+    return {
+        "median_ms": round(statistics.median(durations) * 1000, 3),
+        "min_ms": round(min(durations) * 1000, 3),
+        "queries": query_count,
+    }
+
+
+def print_results(results: dict, as_json: bool = False):
+    if as_json:
+        print(json.dumps(results, indent=2, default=str))
+        return
+    for name, result in results.items():
+        print(f"{name}: {result}")
@@ -0,0 +1,94 @@
+"""Cron entry point that only sets up Django when a Trigger may be due.
+
+Takes the arguments of sync_and_trigger_thermostats, run it every minute
+instead of the command itself:
+
+    * * * * * cd /path/to/app && .venv/bin/python -m fritzbox_thermostat_triggers.launcher
+
+Whether anything is due is looked up in the schedule file the app keeps
+written, without importing Django, pyfritzhome or the settings. Only if a
+Trigger falls into the window, a sync is needed or the file is missing or
+stale, the full command runs, in this very process. After a downtime, the
+window reaches back to the last processed instant, like the command's.
+"""
+
+from pathlib import Path
+import argparse
+import os
+import sys
+import time
+
+from decouple import config
+
+from fritzbox_thermostat_triggers.triggers.schedule_file import get_window_start
+from fritzbox_thermostat_triggers.triggers.schedule_file import is_due
+from fritzbox_thermostat_triggers.triggers.schedule_file import write_processed_until
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+COMMAND = "sync_and_trigger_thermostats"
+
+
+def get_schedule_path() -> str:
+    # Resolved like in the settings, which are not imported on purpose.
+    return config(
+        "TRIGGER_SCHEDULE_PATH",
+        default=str(BASE_DIR / ".trigger_schedule.bin"),
+        cast=str,
+    )
+
+
+def get_processed_until_path() -> str:
+    return config(
+        "TRIGGER_PROCESSED_UNTIL_PATH",
+        default=str(BASE_DIR / ".trigger_processed_until"),
+        cast=str,
+    )
+
+
+def should_run(args: list, now: float) -> bool:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--minutes", default=1, type=int)
+    parser.add_argument("--sync-only", action="store_true", default=False)
+    known, _ = parser.parse_known_args(args)
+    if known.sync_only:
+        return True
+    path = get_schedule_path()
+    if not path:
+        return True
+    processed_until_path = get_processed_until_path()
+    start = get_window_start(
+        processed_until_path,
+        now=now,
+        minutes=known.minutes,
+        max_catch_up=config(
+            "TRIGGER_CATCH_UP_MAX_SECONDS", default=24 * 60 * 60, cast=int
+        ),
+    )
+    if is_due(path, start=start, end=now):
+        return True
+    if processed_until_path:
+        # Nothing was due, so nothing is left to catch up on later.
+        try:
+            write_processed_until(processed_until_path, now)
+        except OSError:
+            pass
+    return False
+
+
+def main(args=None) -> int:
+    args = sys.argv[1:] if args is None else list(args)
+    if not should_run(args, now=time.time()):
+        return 0
+
+    os.environ.setdefault(
+        "DJANGO_SETTINGS_MODULE", "fritzbox_thermostat_triggers.settings"
+    )
+    from django.core.management import execute_from_command_line
+
+    execute_from_command_line(["manage.py", COMMAND, *args])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
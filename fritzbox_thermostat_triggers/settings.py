@@ -142,12 +142,99 @@ LOGIN_REDIRECT_URL = "/triggers"
 FRITZBOX_HOST = config("FRITZBOX_HOST", default="", cast=str)
 FRITZBOX_USER = config("FRITZBOX_USER", default="", cast=str)
 FRITZBOX_PASSWORD = config("FRITZBOX_PASSWORD", default="", cast=str)
+FRITZBOX_SID_CACHE_PATH = config(
+    "FRITZBOX_SID_CACHE_PATH", default=str(BASE_DIR / ".fritzbox_sid.json"), cast=str
+)  # Set to an empty string to disable persisting the session.
+FRITZBOX_SID_TTL_SECONDS = config("FRITZBOX_SID_TTL_SECONDS", default=20 * 60, cast=int)
+FRITZBOX_MAX_CONCURRENT_WRITES = config(
+    "FRITZBOX_MAX_CONCURRENT_WRITES", default=4, cast=int
+)
+# Give up on requests to the Fritzbox after these, setting temperatures on
+# DECT devices may take a few seconds to be acknowledged.
+FRITZBOX_CONNECT_TIMEOUT_SECONDS = config(
+    "FRITZBOX_CONNECT_TIMEOUT_SECONDS", default=5, cast=float
+)
+FRITZBOX_READ_TIMEOUT_SECONDS = config(
+    "FRITZBOX_READ_TIMEOUT_SECONDS", default=15, cast=float
+)
+# After this many failures to reach the Fritzbox in a row, leave it alone for
+# the cooldown, Triggers due meanwhile are skipped and logged.
+FRITZBOX_CIRCUIT_PATH = config(
+    "FRITZBOX_CIRCUIT_PATH", default=str(BASE_DIR / ".fritzbox_circuit.json"), cast=str
+)  # Set to an empty string to only remember failures within a process.
+FRITZBOX_CIRCUIT_FAILURE_THRESHOLD = config(
+    "FRITZBOX_CIRCUIT_FAILURE_THRESHOLD", default=3, cast=int
+)
+FRITZBOX_CIRCUIT_COOLDOWN_SECONDS = config(
+    "FRITZBOX_CIRCUIT_COOLDOWN_SECONDS", default=5 * 60, cast=int
+)
+# Trust the last known target temperature of a device for this long, before
+# asking the Fritzbox again.
+FRITZBOX_DEVICE_CACHE_TTL_SECONDS = config(
+    "FRITZBOX_DEVICE_CACHE_TTL_SECONDS", default=10 * 60, cast=int
+)
+# Runs executing Triggers download the whole device list this often, to find
+# new and renamed devices.
+FRITZBOX_DEVICE_SYNC_INTERVAL_SECONDS = config(
+    "FRITZBOX_DEVICE_SYNC_INTERVAL_SECONDS", default=60 * 60, cast=int
+)
+
+# Held by the running sync_and_trigger_thermostats, runs starting meanwhile
+# are skipped instead of piling up. Set to an empty string to disable.
+TRIGGER_RUN_LOCK_PATH = config(
+    "TRIGGER_RUN_LOCK_PATH", default=str(BASE_DIR / ".trigger_run.lock"), cast=str
+)
+
+# Read by the launcher to skip Django setup when no Trigger is due, set to
+# an empty string to disable writing it. It is rewritten whenever Triggers
+# change, and at least this often in case changes bypassed the app.
+TRIGGER_SCHEDULE_PATH = config(
+    "TRIGGER_SCHEDULE_PATH", default=str(BASE_DIR / ".trigger_schedule.bin"), cast=str
+)
+TRIGGER_SCHEDULE_MAX_AGE_SECONDS = config(
+    "TRIGGER_SCHEDULE_MAX_AGE_SECONDS", default=60 * 60, cast=int
+)
+# Up to when Triggers have been processed, so that the first run after a
+# downtime applies what was missed, going back at most this many seconds.
+TRIGGER_PROCESSED_UNTIL_PATH = config(
+    "TRIGGER_PROCESSED_UNTIL_PATH",
+    default=str(BASE_DIR / ".trigger_processed_until"),
+    cast=str,
+)  # Set to an empty string to only look at the last minutes of each run.
+TRIGGER_CATCH_UP_MAX_SECONDS = config(
+    "TRIGGER_CATCH_UP_MAX_SECONDS", default=24 * 60 * 60, cast=int
+)
+
+# Logs older than this are rolled up into daily summaries by
+# the compact_thermostat_logs command.
+THERMOSTAT_LOG_RETENTION_DAYS = config(
+    "THERMOSTAT_LOG_RETENTION_DAYS", default=90, cast=int
+)
+
+# Timings and counts of Trigger runs, merged across runs and served at
+# /metrics. Also written in the Prometheus text format to the textfile path,
+# if set, e.g. into the directory of the node exporter's textfile collector.
+METRICS_STATE_PATH = config(
+    "METRICS_STATE_PATH", default=str(BASE_DIR / ".metrics.json"), cast=str
+)  # Set to an empty string to disable recording metrics.
+METRICS_TEXTFILE_PATH = config("METRICS_TEXTFILE_PATH", default="", cast=str)
+# Lets Prometheus scrape /metrics with "Authorization: Bearer <token>", only
+# logged in users may see them otherwise.
+METRICS_BEARER_TOKEN = config("METRICS_BEARER_TOKEN", default="", cast=str)
 
 TEMPERATURE_OFF = config("TEMPERATURE_OFF", default=126.5, cast=float)
 TEMPERATURE_FALLBACK = config("TEMPERATURE_FALLBACK", default=0, cast=float)
 
 PUSHOVER_USER_KEY = config("PUSHOVER_USER_KEY", default="", cast=str)
 PUSHOVER_API_TOKEN = config("PUSHOVER_API_TOKEN", default="", cast=str)
+PUSHOVER_API_URL = config(
+    "PUSHOVER_API_URL", default="https://api.pushover.net/1/messages.json", cast=str
+)
+PUSHOVER_MAX_ATTEMPTS = config("PUSHOVER_MAX_ATTEMPTS", default=8, cast=int)
+# Send a single message for all thermostats changed within one run.
+PUSHOVER_MERGE_NOTIFICATIONS = config(
+    "PUSHOVER_MERGE_NOTIFICATIONS", default=False, cast=bool
+)
 
 SENTRY_DSN = config("SENTRY_DSN", default="", cast=str)
 if SENTRY_DSN:
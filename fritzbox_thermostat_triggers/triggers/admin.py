@@ -1,8 +1,10 @@
 from django.contrib import admin
 from django.utils import timezone
 
+from fritzbox_thermostat_triggers.triggers.models import PushNotification
 from fritzbox_thermostat_triggers.triggers.models import Thermostat
 from fritzbox_thermostat_triggers.triggers.models import ThermostatLog
+from fritzbox_thermostat_triggers.triggers.models import ThermostatLogRollup
 from fritzbox_thermostat_triggers.triggers.models import Trigger
 
 
@@ -16,10 +18,13 @@ class ThermostatAdmin(BaseModelAdmin):
         "name",
         "type",
         "ain",
+        "target_temperature",
     )
     readonly_fields = (
         "created_at",
         "updated_at",
+        "target_temperature",
+        "target_temperature_read_at",
     )
     search_fields = ("name", "ain", "id")
 
@@ -34,13 +39,50 @@ class ThermostatLogAdmin(BaseModelAdmin):
         "thermostat",
         "trigger",
         "temperature",
+        "suppressed",
+        "delay_seconds",
     )
     readonly_fields = (
         "created_at",
         "updated_at",
+        "scheduled_for",
+        "delay_seconds",
     )
+    list_filter = ("suppressed",)
     autocomplete_fields = ("thermostat", "trigger")
 
+class ThermostatLogRollupAdmin(BaseModelAdmin):
+    list_display = (
+        "date",
+        "thermostat",
+        "count",
+        "no_op_ratio",
+        "last_temperature",
+    )
+    readonly_fields = (
+        "created_at",
+        "updated_at",
+    )
+    autocomplete_fields = ("thermostat",)
+    date_hierarchy = "date"
+    list_filter = ("thermostat",)
+
+    def no_op_ratio(self, rollup):
+        return f"{rollup.no_op_ratio:.0%}"
+
+class PushNotificationAdmin(BaseModelAdmin):
+    list_display = (
+        "created_at",
+        "title",
+        "sent_at",
+        "attempts",
+    )
+    readonly_fields = (
+        "created_at",
+        "updated_at",
+    )
+    list_filter = ("sent_at",)
+
 class TriggerAdmin(BaseModelAdmin):
     list_display = (
         "label",
@@ -48,10 +90,14 @@ class TriggerAdmin(BaseModelAdmin):
         "temperature",
         "at_time",
         "recurring",
+        "last_executed_at",
     )
     readonly_fields = (
         "created_at",
         "updated_at",
+        "next_fire_at",
+        "last_executed_at",
+        "last_executed_no_op",
     )
     autocomplete_fields = ("thermostat",)
     search_fields = ("name", "time", "thermostat__name")
@@ -74,6 +120,8 @@ class TriggerAdmin(BaseModelAdmin):
 
 admin.site.site_header = "Thermostat Triggers"
 admin.site.site_url = "/triggers"
+admin.site.register(PushNotification, PushNotificationAdmin)
 admin.site.register(Thermostat, ThermostatAdmin)
 admin.site.register(ThermostatLog, ThermostatLogAdmin)
+admin.site.register(ThermostatLogRollup, ThermostatLogRollupAdmin)
 admin.site.register(Trigger, TriggerAdmin)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TriggersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "fritzbox_thermostat_triggers.triggers"
+
+    def ready(self):
+        # Keep the schedule file in sync with changes to Triggers.
+        from fritzbox_thermostat_triggers.triggers import schedule  # noqa
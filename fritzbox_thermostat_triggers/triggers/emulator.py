@@ -0,0 +1,320 @@
+"""A local stand-in for the AHA HTTP interface of a Fritzbox.
+
+Speaks just enough of it for pyfritzhome and this app: the PBKDF2 login
+challenge, sessions that expire when idle, `getdevicelistinfos`,
+`gethkrtsoll` and `sethkrtsoll`. Latency and failures can be injected, so
+the real HTTP path can be tested end to end and under load. Point
+`FRITZBOX_HOST` at it, e.g. via the run_fritzbox_emulator command.
+"""
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Optional
+import hashlib
+import logging
+import random
+import secrets
+import threading
+import time
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+EMPTY_SID = "0000000000000000"
+
+# Raw target temperatures, in half degrees.
+TSOLL_OFF = 253
+TSOLL_ON = 254
+
+HKR = (
+    "<hkr><tist>42</tist><tsoll>{tsoll}</tsoll><absenk>32</absenk>"
+    "<komfort>42</komfort><lock>0</lock><devicelock>0</devicelock>"
+    "<errorcode>0</errorcode><windowopenactiv>0</windowopenactiv>"
+    "<windowopenactiveendtime>0</windowopenactiveendtime>"
+    "<boostactive>0</boostactive><boostactiveendtime>0</boostactiveendtime>"
+    "<batterylow>0</batterylow><battery>80</battery>"
+    "<nextchange><endperiod>1538341200</endperiod><tchange>32</tchange>"
+    "</nextchange><summeractive>0</summeractive><holidayactive>0</holidayactive>"
+    "</hkr>"
+)
+
+DEVICE_TEMPLATES = {
+    "thermostat": (
+        '<device identifier="{ain}" id="{id}" functionbitmask="320" '
+        'fwversion="05.16" manufacturer="AVM" productname="FRITZ!DECT 301">'
+        "<present>{present}</present><txbusy>0</txbusy><name>{name}</name>"
+        "<battery>80</battery><batterylow>0</batterylow>"
+        "<temperature><celsius>210</celsius><offset>0</offset></temperature>"
+        + HKR
+        + "</device>"
+    ),
+    "plug": (
+        '<device identifier="{ain}" id="{id}" functionbitmask="35712" '
+        'fwversion="04.16" manufacturer="AVM" productname="FRITZ!DECT 200">'
+        "<present>{present}</present><txbusy>0</txbusy><name>{name}</name>"
+        "<switch><state>1</state><mode>auto</mode><lock>0</lock>"
+        "<devicelock>0</devicelock></switch><simpleonoff><state>1</state>"
+        "</simpleonoff><powermeter><voltage>230000</voltage><power>1000</power>"
+        "<energy>5000</energy></powermeter>"
+        "<temperature><celsius>225</celsius><offset>0</offset></temperature>"
+        "</device>"
+    ),
+    "repeater": (
+        '<device identifier="{ain}" id="{id}" functionbitmask="1280" '
+        'fwversion="04.16" manufacturer="AVM" productname="FRITZ!DECT Repeater 100">'
+        "<present>{present}</present><txbusy>0</txbusy><name>{name}</name>"
+        "<temperature><celsius>230</celsius><offset>0</offset></temperature>"
+        "</device>"
+    ),
+    "group": (
+        '<group identifier="{ain}" id="{id}" functionbitmask="4160" '
+        'fwversion="1.0" manufacturer="AVM" productname="">'
+        "<present>{present}</present><txbusy>0</txbusy><name>{name}</name>"
+        + HKR
+        + "<groupinfo><masterdeviceid>0</masterdeviceid><members>{members}"
+        "</members></groupinfo></group>"
+    ),
+}
+
+
+class EmulatedDevice:
+    __slots__ = ("ain", "id", "kind", "name", "present", "tsoll")
+
+    def __init__(self, ain: str, id: int, kind: str, name: str, tsoll: int = 42):
+        self.ain = ain
+        self.id = id
+        self.kind = kind
+        self.name = name
+        self.present = True
+        self.tsoll = tsoll
+
+    @property
+    def has_thermostat(self) -> bool:
+        return self.kind in ("thermostat", "group")
+
+    def render(self, members: str = "") -> str:
+        return DEVICE_TEMPLATES[self.kind].format(
+            ain=self.ain,
+            id=self.id,
+            members=members,
+            name=self.name,
+            present=int(self.present),
+            tsoll=self.tsoll,
+        )
+
+
+class FritzboxEmulator:
+    """State of an emulated Fritzbox, shared by all requests to it.
+
+    Latencies are in seconds and apply to each request, writes additionally
+    wait for the slow DECT roundtrip. `failure_rate` is the share of AHA
+    requests answered with an HTTP 500, `failing_ains` always fail.
+    """
+
+    def __init__(
+        self,
+        thermostat_count: int = 10,
+        other_device_count: int = 0,
+        group_count: int = 0,
+        user: str = "admin",
+        password: str = "password",
+        latency: float = 0,
+        write_latency: float = 0,
+        failure_rate: float = 0,
+        failing_ains: Optional[set] = None,
+        session_ttl: float = 20 * 60,
+        pbkdf2_iterations: int = 10,
+        seed: Optional[int] = None,
+    ):
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.write_latency = write_latency
+        self.failure_rate = failure_rate
+        self.failing_ains = set(failing_ains or ())
+        self.session_ttl = session_ttl
+        self.pbkdf2_iterations = pbkdf2_iterations
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.sessions: dict = {}  # Last use by SID.
+        self.challenges: dict = {}  # By their dynamic salt.
+        self.login_count = 0
+        self.request_counts: Counter = Counter()
+
+        self.devices: dict = {}
+        for n in range(thermostat_count):
+            self.add_device(f"11959 {n:07d}", "thermostat", f"Thermostat {n}")
+        for n in range(other_device_count):
+            kind = "repeater" if n % 3 == 2 else "plug"
+            self.add_device(f"08761 {n:07d}", kind, f"{kind.title()} {n}")
+        for n in range(group_count):
+            self.add_device(f"grp303E4F-3F{n:07d}", "group", f"Group {n}")
+
+    def add_device(self, ain: str, kind: str, name: str) -> EmulatedDevice:
+        device = EmulatedDevice(ain, id=16 + len(self.devices), kind=kind, name=name)
+        self.devices[ain] = device
+        return device
+
+    def get_target_temperature(self, ain: str) -> float:
+        """Return the temperature of a device the way pyfritzhome would."""
+        return self.devices[ain].tsoll / 2
+
+    def render_device_list(self) -> str:
+        thermostat_ids = ",".join(
+            str(device.id)
+            for device in self.devices.values()
+            if device.kind == "thermostat"
+        )
+        return (
+            '<devicelist version="1" fwversion="7.57">'
+            + "".join(
+                device.render(members=thermostat_ids)
+                for device in self.devices.values()
+            )
+            + "</devicelist>"
+        )
+
+    # Sessions
+
+    def create_challenge(self) -> str:
+        salt1 = secrets.token_hex(16)
+        salt2 = secrets.token_hex(16)
+        challenge = (
+            f"2${self.pbkdf2_iterations}${salt1}${self.pbkdf2_iterations}${salt2}"
+        )
+        with self.lock:
+            self.challenges[salt2] = challenge
+        return challenge
+
+    def check_response(self, username: str, response: str) -> bool:
+        salt2, _, hashed = response.partition("$")
+        with self.lock:
+            challenge = self.challenges.pop(salt2, None)
+        if challenge is None or username != self.user:
+            return False
+        _, iter1, salt1, iter2, _ = challenge.split("$")
+        hash1 = hashlib.pbkdf2_hmac(
+            "sha256", self.password.encode(), bytes.fromhex(salt1), int(iter1)
+        )
+        hash2 = hashlib.pbkdf2_hmac("sha256", hash1, bytes.fromhex(salt2), int(iter2))
+        return secrets.compare_digest(hash2.hex(), hashed)
+
+    def create_session(self) -> str:
+        sid = secrets.token_hex(8)
+        with self.lock:
+            self.sessions[sid] = time.monotonic()
+            self.login_count += 1
+        return sid
+
+    def use_session(self, sid: Optional[str]) -> bool:
+        """Return whether the SID is valid, which keeps it alive."""
+        now = time.monotonic()
+        with self.lock:
+            last_used_at = self.sessions.get(sid)
+            if last_used_at is None or now - last_used_at >= self.session_ttl:
+                self.sessions.pop(sid, None)
+                return False
+            self.sessions[sid] = now
+            return True
+
+    def expire_sessions(self):
+        with self.lock:
+            self.sessions.clear()
+
+    # Requests
+
+    def login(self, params: dict) -> tuple:
+        sid = EMPTY_SID
+        if params.get("sid") and self.use_session(params["sid"]):
+            sid = params["sid"]
+            if params.get("security:command/logout"):
+                with self.lock:
+                    self.sessions.pop(sid, None)
+                sid = EMPTY_SID
+        elif params.get("username") and params.get("response"):
+            if self.check_response(params["username"], params["response"]):
+                sid = self.create_session()
+        return 200, (
+            "<?xml version='1.0' encoding='utf-8'?><SessionInfo>"
+            f"<SID>{sid}</SID><Challenge>{self.create_challenge()}</Challenge>"
+            "<BlockTime>0</BlockTime><Rights></Rights><Users>"
+            f"<User last='1'>{self.user}</User></Users></SessionInfo>"
+        )
+
+    def aha(self, params: dict) -> tuple:
+        command = params.get("switchcmd", "")
+        with self.lock:
+            self.request_counts[command] += 1
+        if not self.use_session(params.get("sid")):
+            return 403, "Forbidden"
+
+        ain = params.get("ain")
+        if ain in self.failing_ains or (
+            self.failure_rate and self.random.random() < self.failure_rate
+        ):
+            return 500, "Internal Server Error"
+
+        if command == "getdevicelistinfos":
+            return 200, self.render_device_list()
+        if command == "getswitchlist":
+            return 200, ",".join(self.devices)
+
+        device = self.devices.get(ain)
+        if device is None:
+            return 400, "Bad Request"
+        if command == "gethkrtsoll":
+            if not device.has_thermostat:
+                return 200, "inval"
+            return 200, str(device.tsoll)
+        if command == "sethkrtsoll":
+            try:
+                tsoll = int(params.get("param", ""))
+            except ValueError:
+                return 200, "inval"
+            if not device.has_thermostat or not (
+                16 <= tsoll <= 56 or tsoll in (TSOLL_OFF, TSOLL_ON)
+            ):
+                return 200, "inval"
+            if self.write_latency:
+                time.sleep(self.write_latency)
+            device.tsoll = tsoll
+            return 200, str(tsoll)
+        if command == "getdeviceinfos":
+            return 200, device.render()
+        return 200, "inval"
+
+    def make_server(self, host: str = "127.0.0.1", port: int = 0):
+        """Return an HTTP server for this emulator, not yet serving."""
+        handler = type("BoundRequestHandler", (EmulatorRequestHandler,), {})
+        handler.emulator = self
+        return ThreadingHTTPServer((host, port), handler)
+
+
+class EmulatorRequestHandler(BaseHTTPRequestHandler):
+    emulator: FritzboxEmulator
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        if self.emulator.latency:
+            time.sleep(self.emulator.latency)
+
+        if url.path == "/login_sid.lua":
+            status, body = self.emulator.login(params)
+        elif url.path == "/webservices/homeautoswitch.lua":
+            status, body = self.emulator.aha(params)
+        else:
+            status, body = 404, "Not Found"
+
+        content = (body + "\n").encode()
+        self.send_response(status)
+        content_type = "text/xml" if body.startswith("<") else "text/plain"
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
@@ -0,0 +1,431 @@
+"""Fritzbox connection handling.
+
+Logging in to the Fritzbox is an expensive challenge/response roundtrip, so
+a single session is shared per process and its SID is cached on disk to be
+reused by later runs, until the box rejects it.
+
+When the box is unreachable, a circuit breaker (also kept on disk) stops
+talking to it for a while, so runs fail fast instead of waiting for each
+request to time out.
+"""
+
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+from xml.etree import ElementTree
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from pyfritzhome import Fritzhome
+from requests.exceptions import ConnectionError
+from requests.exceptions import HTTPError
+from requests.exceptions import Timeout
+
+from fritzbox_thermostat_triggers.triggers.schedule_file import write_atomically
+
+logger = logging.getLogger(__name__)
+
+_connections: dict = {}
+_circuit_breakers: dict = {}
+
+# Requests sent to the Fritzbox by this process, by AHA command or "login".
+request_counts: Counter = Counter()
+_request_counts_lock = threading.Lock()
+
+# Bit of the functionbitmask of AHA devices (and groups) with a thermostat.
+THERMOSTAT_FUNCTION_BIT = 0x40
+# Bytes of the device list read from the connection at a time.
+DEVICE_LIST_CHUNK_SIZE = 16 * 1024
+
+
+def count_request(command: str):
+    with _request_counts_lock:
+        request_counts[command] += 1
+
+
+class SidCache:
+    """Persist the SID of a Fritzbox session alongside its expiry."""
+
+    # Avoid rewriting the file on each request, only to slide its expiry.
+    touch_interval_seconds = 60
+
+    def __init__(self, path: Optional[Path], host: str, user: str, ttl: int):
+        self.path = Path(path) if path else None
+        self.host = host
+        self.user = user
+        self.ttl = ttl
+        self.expires_at: float = 0
+
+    def load(self) -> Optional[str]:
+        if self.path is None:
+            return None
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return None
+        if data.get("host") != self.host or data.get("user") != self.user:
+            return None
+        if data.get("expires_at", 0) <= time.time():
+            return None
+        self.expires_at = data["expires_at"]
+        return data.get("sid")
+
+    def store(self, sid: Optional[str]):
+        self.expires_at = time.time() + self.ttl
+        if self.path is None:
+            return
+        data = {
+            "host": self.host,
+            "user": self.user,
+            "sid": sid,
+            "expires_at": self.expires_at,
+        }
+        try:
+            # The SID grants access to the box, keep it private.
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+        except OSError:
+            logger.warning(f"Could not write Fritzbox SID cache to {self.path}")
+
+    def touch(self, sid: Optional[str]):
+        remaining = self.expires_at - time.time()
+        if self.ttl - remaining >= self.touch_interval_seconds:
+            self.store(sid)
+
+    def clear(self):
+        self.expires_at = 0
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+
+
+class FritzboxUnavailableError(ConnectionError):
+    """Raised instead of a request while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Remember failures to reach the Fritzbox, shared by runs via a file.
+
+    After `threshold` consecutive failures the circuit opens and no request
+    is sent for `cooldown` seconds. Then requests are let through again, a
+    success closes the circuit while another failure opens it right away.
+    """
+
+    def __init__(self, path: Optional[Path], host: str, threshold: int, cooldown: int):
+        self.path = Path(path) if path else None
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures: int = 0
+        self.opened_at: float = 0
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return
+        if data.get("host") == self.host:
+            self.failures = data.get("failures", 0)
+            self.opened_at = data.get("opened_at", 0)
+
+    def store(self):
+        if self.path is None:
+            return
+        data = {
+            "host": self.host,
+            "failures": self.failures,
+            "opened_at": self.opened_at,
+        }
+        try:
+            # Runs read it concurrently, never let them see half of it.
+            write_atomically(str(self.path), json.dumps(data).encode())
+        except OSError:
+            logger.warning(f"Could not write Fritzbox circuit state to {self.path}")
+
+    def get_open_until(self) -> Optional[float]:
+        """Return until when no requests are sent, None if they are."""
+        if self.failures < self.threshold:
+            return None
+        open_until = self.opened_at + self.cooldown
+        return open_until if open_until > time.time() else None
+
+    def is_open(self) -> bool:
+        return self.get_open_until() is not None
+
+    def record_success(self):
+        with self.lock:
+            if not self.failures:
+                return
+            if self.failures >= self.threshold:
+                logger.info("Fritzbox reachable again, closing circuit")
+            self.failures = 0
+            self.opened_at = 0
+            self.store()
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.failures == self.threshold:
+                    logger.warning(
+                        f"Fritzbox unreachable {self.failures} times in a row, "
+                        f"not talking to it for {self.cooldown}s"
+                    )
+                self.opened_at = time.time()
+            self.store()
+
+
+class ThermostatRecord:
+    """The little we need to know about a thermostat device.
+
+    Stands in for the full pyfritzhome device, with the same attributes.
+    """
+
+    __slots__ = ("ain", "name", "present", "target_temperature")
+
+    has_thermostat = True
+
+    def __init__(self, ain, name, present, target_temperature):
+        self.ain: str = ain
+        self.name: str = name
+        self.present: bool = present
+        self.target_temperature: Optional[float] = target_temperature
+
+    def __str__(self):
+        return f"{self.ain} {self.name}"
+
+
+def parse_thermostat_devices(chunks) -> list:
+    """Return ThermostatRecords for the thermostats in an AHA device list.
+
+    Given chunks of a `getdevicelistinfos` response are parsed as they come,
+    each device is thrown away once read, so other kinds of devices never
+    turn into objects and the whole tree is never held in memory.
+    """
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    records = []
+    root = None
+
+    def read_events():
+        nonlocal root
+        for event, element in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = element
+                continue
+            if element.tag not in ("device", "group") or element is root:
+                continue
+
+            functionbitmask = int(element.get("functionbitmask") or 0)
+            if functionbitmask & THERMOSTAT_FUNCTION_BIT:
+                records.append(read_thermostat_record(element))
+            root.clear()
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        read_events()
+    parser.close()
+    read_events()
+    return records
+
+
+def read_thermostat_record(element) -> ThermostatRecord:
+    present = element.findtext("present") == "1"
+    target_temperature = None
+    if present:
+        # Like pyfritzhome does, in half degrees with 253 being off.
+        try:
+            target_temperature = float(element.findtext("hkr/tsoll")) / 2
+        except (TypeError, ValueError):
+            pass
+    return ThermostatRecord(
+        ain=element.get("identifier"),
+        name=element.findtext("name") or "",
+        present=present,
+        target_temperature=target_temperature,
+    )
+
+
+class SessionFritzhome(Fritzhome):
+    """Fritzhome that reuses a cached SID and logs in only when rejected."""
+
+    def __init__(
+        self,
+        host,
+        user,
+        password,
+        sid_cache: SidCache,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        **kwargs,
+    ):
+        super().__init__(host, user, password, **kwargs)
+        self.sid_cache = sid_cache
+        self.circuit_breaker = circuit_breaker
+        self.login_count: int = 0
+        # Devices may be written to from several threads at once.
+        self.login_lock = threading.Lock()
+
+    def login(self):
+        super().login()
+        self.login_count += 1
+        count_request("login")
+        self.sid_cache.store(self._sid)
+
+    def relogin(self, rejected_sid: Optional[str]):
+        """Log in, unless another thread already replaced the rejected SID."""
+        with self.login_lock:
+            if self._sid != rejected_sid:
+                return
+            self.sid_cache.clear()
+            self.login()
+
+    def resume(self) -> bool:
+        """Reuse a cached SID if available, return whether that worked."""
+        sid = self.sid_cache.load()
+        if not sid:
+            return False
+        self._sid = sid
+        return True
+
+    def get_thermostat_devices(self) -> list:
+        """Return ThermostatRecords for all thermostats known to the box.
+
+        The device list is parsed while it is being downloaded.
+        """
+        response = self._aha_request("getdevicelistinfos", stream=True)
+        with response:
+            return parse_thermostat_devices(
+                response.iter_content(chunk_size=DEVICE_LIST_CHUNK_SIZE)
+            )
+
+    def _request(self, url, params=None, stream=False):
+        if self.circuit_breaker is None:
+            return self._send_request(url, params, stream)
+        if self.circuit_breaker.is_open():
+            raise FritzboxUnavailableError("Fritzbox circuit breaker is open")
+        try:
+            result = self._send_request(url, params, stream)
+        except (ConnectionError, Timeout):
+            self.circuit_breaker.record_failure()
+            raise
+        except HTTPError:
+            # The box did answer, just not the way we hoped.
+            self.circuit_breaker.record_success()
+            raise
+        self.circuit_breaker.record_success()
+        return result
+
+    def _send_request(self, url, params, stream: bool):
+        if not stream:
+            return super()._request(url, params)
+        # Return the response itself, for its body to be read as it arrives.
+        response = self._session.get(
+            url,
+            params=params,
+            timeout=self._timeout,
+            verify=self._ssl_verify,
+            stream=True,
+        )
+        try:
+            response.raise_for_status()
+        except HTTPError:
+            response.close()
+            raise
+        return response
+
+    def _aha_request(self, cmd, ain=None, param=None, rf=str, stream=False):
+        sid = self._sid
+        if not sid:
+            self.relogin(sid)
+        count_request(cmd)
+        try:
+            result = self._send_aha_request(cmd, ain, param, rf, stream)
+        except HTTPError as error:
+            # The box answers 403 for SIDs it does not know (anymore).
+            if error.response is None or error.response.status_code != 403:
+                raise
+            logger.info("Fritzbox rejected cached session, logging in again")
+            self.relogin(sid)
+            count_request(cmd)
+            result = self._send_aha_request(cmd, ain, param, rf, stream)
+        self.sid_cache.touch(self._sid)
+        return result
+
+    def _send_aha_request(self, cmd, ain, param, rf, stream: bool):
+        if not stream:
+            return super()._aha_request(cmd, ain=ain, param=param, rf=rf)
+        # Like pyfritzhome builds the request, without reading the response.
+        params = {"switchcmd": cmd, "sid": self._sid}
+        if param:
+            params.update(param)
+        if ain:
+            params["ain"] = ain
+        url = f"{self.base_url}/webservices/homeautoswitch.lua"
+        return self._request(url, params, stream=True)
+
+
+def get_fritzbox_connection(
+    host: Optional[str] = None,
+    user: Optional[str] = None,
+    password: Optional[str] = None,
+) -> SessionFritzhome:
+    """Return the Fritzbox session shared by this process."""
+    host = host or settings.FRITZBOX_HOST
+    user = user or settings.FRITZBOX_USER
+    password = password or settings.FRITZBOX_PASSWORD
+
+    key = (host, user)
+    fritzbox = _connections.get(key)
+    if fritzbox is not None:
+        return fritzbox
+
+    sid_cache = SidCache(
+        settings.FRITZBOX_SID_CACHE_PATH,
+        host=host,
+        user=user,
+        ttl=settings.FRITZBOX_SID_TTL_SECONDS,
+    )
+    fritzbox = SessionFritzhome(
+        host,
+        user,
+        password,
+        sid_cache=sid_cache,
+        circuit_breaker=get_fritzbox_circuit_breaker(host),
+        timeout=(
+            settings.FRITZBOX_CONNECT_TIMEOUT_SECONDS,
+            settings.FRITZBOX_READ_TIMEOUT_SECONDS,
+        ),
+    )
+    if not fritzbox.resume():
+        fritzbox.login()
+    _connections[key] = fritzbox
+    return fritzbox
+
+
+def get_fritzbox_circuit_breaker(host: Optional[str] = None) -> CircuitBreaker:
+    """Return the circuit breaker of the Fritzbox shared by this process."""
+    host = host or settings.FRITZBOX_HOST
+    circuit_breaker = _circuit_breakers.get(host)
+    if circuit_breaker is None:
+        circuit_breaker = CircuitBreaker(
+            settings.FRITZBOX_CIRCUIT_PATH,
+            host=host,
+            threshold=settings.FRITZBOX_CIRCUIT_FAILURE_THRESHOLD,
+            cooldown=settings.FRITZBOX_CIRCUIT_COOLDOWN_SECONDS,
+        )
+        _circuit_breakers[host] = circuit_breaker
+    return circuit_breaker
+
+
+def reset_fritzbox_connections():
+    """Forget all sessions of this process, the on-disk caches are kept."""
+    _connections.clear()
+    _circuit_breakers.clear()
@@ -0,0 +1,145 @@
+from datetime import datetime
+from datetime import timedelta
+from typing import Optional
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db import transaction
+from django.utils import timezone
+
+from fritzbox_thermostat_triggers.triggers.models import ThermostatLog
+from fritzbox_thermostat_triggers.triggers.models import ThermostatLogRollup
+
+logger = logging.getLogger(__name__)
+
+
+def get_compaction_cutoff(days: int, now: Optional[datetime] = None) -> datetime:
+    """Return local midnight `days` ago, so only whole days are rolled up."""
+    now = timezone.localtime(now)
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight - timedelta(days=days)
+
+
+def compact_log_chunk(before: datetime, chunk_size: int) -> int:
+    """Roll the oldest logs before given time up, return how many were."""
+    with transaction.atomic():
+        rows = list(
+            ThermostatLog.objects.filter(created_at__lt=before)
+            .order_by("created_at", "id")
+            .values_list(
+                "id",
+                "thermostat_id",
+                "created_at",
+                "temperature",
+                "no_op",
+                "suppressed",
+            )[:chunk_size]
+        )
+        if not rows:
+            return 0
+
+        chunk: dict = {}
+        for _, thermostat_id, created_at, temperature, no_op, suppressed in rows:
+            key = (thermostat_id, timezone.localtime(created_at).date())
+            rollup = chunk.get(key)
+            if rollup is None:
+                rollup = chunk[key] = ThermostatLogRollup(
+                    thermostat_id=thermostat_id,
+                    date=key[1],
+                    last_temperature=temperature,
+                    last_logged_at=created_at,
+                )
+            rollup.count += 1
+            rollup.no_op_count += no_op or suppressed
+            # Rows come oldest first, so the last one seen is the latest.
+            if not suppressed:
+                rollup.last_temperature = temperature
+            rollup.last_logged_at = created_at
+
+        # A day may span several chunks (or runs), merge into what is there.
+        existing = ThermostatLogRollup.objects.filter(
+            thermostat_id__in={thermostat_id for thermostat_id, _ in chunk},
+            date__in={date for _, date in chunk},
+        )
+        now = timezone.now()
+        to_update = []
+        for rollup in existing:
+            key = (rollup.thermostat_id, rollup.date)
+            if key not in chunk:
+                continue
+            new = chunk.pop(key)
+            rollup.count += new.count
+            rollup.no_op_count += new.no_op_count
+            if new.last_logged_at >= rollup.last_logged_at:
+                rollup.last_temperature = new.last_temperature
+                rollup.last_logged_at = new.last_logged_at
+            rollup.updated_at = now
+            to_update.append(rollup)
+
+        ThermostatLogRollup.objects.bulk_create(chunk.values())
+        ThermostatLogRollup.objects.bulk_update(
+            to_update,
+            ["count", "no_op_count", "last_temperature", "last_logged_at", "updated_at"],
+        )
+        ThermostatLog.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
+
+
+def compact_thermostat_logs(before: datetime, chunk_size: int) -> int:
+    """Roll all logs before given time up, one short transaction per chunk."""
+    compacted_count = 0
+    while True:
+        count = compact_log_chunk(before, chunk_size)
+        compacted_count += count
+        if count < chunk_size:
+            return compacted_count
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            action="store",
+            default=settings.THERMOSTAT_LOG_RETENTION_DAYS,
+            dest="days",
+            help="Keep the logs of this many past days as they are",
+            type=int,
+        )
+        parser.add_argument(
+            "--chunk-size",
+            action="store",
+            default=500,
+            dest="chunk_size",
+            help="Logs to compact per transaction, keeping write locks short",
+            type=int,
+        )
+        parser.add_argument(
+            "--vacuum",
+            action="store_true",
+            default=False,
+            dest="vacuum",
+            help="Give the freed space back to the operating system afterwards",
+        )
+        parser.add_argument(
+            "--verbose", action="store_true", default=False, dest="verbose"
+        )
+
+    def handle(self, *args, **options):
+        days: int = options["days"]
+        chunk_size: int = options["chunk_size"]
+        vacuum: bool = options["vacuum"]
+        verbose: bool = options["verbose"]
+
+        before = get_compaction_cutoff(days)
+        compacted_count = compact_thermostat_logs(before, chunk_size)
+        if verbose:
+            logger.info(f"Compacted {compacted_count} log(s) before {before}")
+
+        if vacuum:
+            # VACUUM can't run in a transaction, there is none outside atomic().
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
+            if verbose:
+                logger.info("Vacuumed database")
@@ -0,0 +1,101 @@
+from datetime import datetime
+from datetime import timedelta
+from typing import Optional
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import F
+from django.db.models import Window
+from django.db.models.functions import CumeDist
+from django.utils import timezone
+
+from fritzbox_thermostat_triggers.triggers.models import ThermostatLog
+
+PERCENTILES = (50, 95, 99)
+
+
+def get_latency_percentiles(since: Optional[datetime] = None) -> list:
+    """Return how late Triggers were executed, per Thermostat.
+
+    Computed by a single query: a window ranks the delays of each
+    Thermostat, of which the smallest one at or above the rank of each
+    percentile is picked (nearest rank). Manual executions are left out.
+    """
+    logs = ThermostatLog.objects.filter(delay_seconds__isnull=False)
+    if since is not None:
+        logs = logs.filter(created_at__gte=since)
+    ranked = logs.annotate(
+        delay_rank=Window(
+            CumeDist(),
+            partition_by=F("thermostat_id"),
+            order_by=F("delay_seconds").asc(),
+        )
+    ).values(
+        "thermostat_id",
+        "delay_seconds",
+        "delay_rank",
+        thermostat_name=F("thermostat__name"),
+    )
+    sql, params = ranked.query.sql_with_params()
+
+    # The ORM can't aggregate over a window, so that is done around it.
+    percentile_columns = ", ".join(
+        "MIN(CASE WHEN delay_rank >= %s THEN delay_seconds END)"
+        for _ in PERCENTILES
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT thermostat_id, thermostat_name, COUNT(*), "
+            f"{percentile_columns}, MAX(delay_seconds) FROM ({sql}) ranked "
+            "GROUP BY thermostat_id, thermostat_name "
+            "ORDER BY thermostat_name, thermostat_id",
+            (*(percentile / 100 for percentile in PERCENTILES), *params),
+        )
+        rows = cursor.fetchall()
+
+    return [
+        {
+            "thermostat_id": thermostat_id,
+            "thermostat": name,
+            "count": count,
+            **{
+                f"p{percentile}": value
+                for percentile, value in zip(PERCENTILES, values)
+            },
+            "max": maximum,
+        }
+        for thermostat_id, name, count, *values, maximum in rows
+    ]
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            action="store",
+            default=7,
+            dest="days",
+            type=int,
+            help="Only consider executions of this many last days, 0 for all",
+        )
+
+    def handle(self, *args, **options):
+        days: int = options["days"]
+
+        since = timezone.now() - timedelta(days=days) if days else None
+        rows = get_latency_percentiles(since=since)
+        if not rows:
+            self.stdout.write("No scheduled executions logged yet")
+            return
+
+        columns = ["count", *(f"p{percentile}" for percentile in PERCENTILES), "max"]
+        width = max(len("Thermostat"), *(len(row["thermostat"]) for row in rows))
+        self.stdout.write(
+            f"{'Thermostat':<{width}}"
+            + "".join(f"{column:>10}" for column in columns)
+        )
+        for row in rows:
+            self.stdout.write(
+                f"{row['thermostat']:<{width}}{row['count']:>10}"
+                + "".join(f"{row[column]:>9.1f}s" for column in columns[1:])
+            )
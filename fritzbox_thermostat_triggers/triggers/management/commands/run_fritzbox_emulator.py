@@ -0,0 +1,95 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from fritzbox_thermostat_triggers.triggers.emulator import FritzboxEmulator
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--host", action="store", default="127.0.0.1", dest="host", type=str
+        )
+        parser.add_argument(
+            "--port", action="store", default=8089, dest="port", type=int
+        )
+        parser.add_argument(
+            "--thermostats", action="store", default=10, dest="thermostats", type=int
+        )
+        parser.add_argument(
+            "--other-devices",
+            action="store",
+            default=0,
+            dest="other_devices",
+            type=int,
+            help="Plugs and repeaters listed along with the thermostats",
+        )
+        parser.add_argument(
+            "--groups", action="store", default=0, dest="groups", type=int
+        )
+        parser.add_argument(
+            "--user", action="store", default="admin", dest="user", type=str
+        )
+        parser.add_argument(
+            "--password", action="store", default="password", dest="password", type=str
+        )
+        parser.add_argument(
+            "--latency-ms",
+            action="store",
+            default=0,
+            dest="latency_ms",
+            type=int,
+            help="Delay of each request",
+        )
+        parser.add_argument(
+            "--write-latency-ms",
+            action="store",
+            default=0,
+            dest="write_latency_ms",
+            type=int,
+            help="Additional delay of setting a temperature, as DECT is slow",
+        )
+        parser.add_argument(
+            "--failure-rate",
+            action="store",
+            default=0,
+            dest="failure_rate",
+            type=float,
+            help="Share of requests to fail with an HTTP 500, from 0 to 1",
+        )
+        parser.add_argument(
+            "--session-ttl-seconds",
+            action="store",
+            default=20 * 60,
+            dest="session_ttl_seconds",
+            type=int,
+            help="Idle time after which a session expires",
+        )
+
+    def handle(self, *args, **options):
+        emulator = FritzboxEmulator(
+            thermostat_count=options["thermostats"],
+            other_device_count=options["other_devices"],
+            group_count=options["groups"],
+            user=options["user"],
+            password=options["password"],
+            latency=options["latency_ms"] / 1000,
+            write_latency=options["write_latency_ms"] / 1000,
+            failure_rate=options["failure_rate"],
+            session_ttl=options["session_ttl_seconds"],
+        )
+        server = emulator.make_server(options["host"], options["port"])
+        host, port = server.server_address[:2]
+        logger.info(
+            f"Emulating a Fritzbox with {len(emulator.devices)} devices, point "
+            f"the app at it with FRITZBOX_HOST=http://{host}:{port} "
+            f"FRITZBOX_USER={emulator.user} FRITZBOX_PASSWORD={emulator.password}"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,141 @@
+from datetime import datetime
+from datetime import timedelta
+import heapq
+import logging
+import math
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Count
+from django.db.models import Max
+from django.utils import timezone
+
+from fritzbox_thermostat_triggers.triggers.models import Trigger
+from fritzbox_thermostat_triggers.triggers.schedule import get_processed_until
+
+logger = logging.getLogger(__name__)
+
+
+class TriggerScheduler:
+    """In-memory priority queue of the next fire times of enabled Triggers."""
+
+    def __init__(self):
+        self.queue: list = []  # Heap of (fire_at, trigger_id).
+        self.fingerprint = None
+
+    def get_fingerprint(self) -> tuple:
+        """Return a cheap summary that changes whenever Trigger rows change."""
+        aggregated = Trigger.objects.aggregate(
+            count=Count("id"), updated_at=Max("updated_at")
+        )
+        return (aggregated["count"], aggregated["updated_at"])
+
+    def reload(self, after: datetime):
+        self.fingerprint = self.get_fingerprint()
+        self.queue = []
+        for trigger in Trigger.objects.filter(enabled=True):
+            fire_at = trigger.get_next_fire_at(after)
+            if fire_at is not None:
+                self.queue.append((fire_at, trigger.id))
+        heapq.heapify(self.queue)
+
+    def reload_if_changed(self, after: datetime) -> bool:
+        if self.get_fingerprint() == self.fingerprint:
+            return False
+        self.reload(after)
+        return True
+
+    def pop_due(self, now: datetime) -> list:
+        """Remove and return all (fire_at, trigger_id) entries due by now."""
+        due = []
+        while self.queue and self.queue[0][0] <= now:
+            due.append(heapq.heappop(self.queue))
+        return due
+
+    def reschedule(self, trigger_ids: list, after: datetime):
+        """Queue the next occurrence of given (recurring) Triggers."""
+        for trigger in Trigger.objects.filter(id__in=trigger_ids, enabled=True):
+            fire_at = trigger.get_next_fire_at(after)
+            if fire_at is not None:
+                heapq.heappush(self.queue, (fire_at, trigger.id))
+
+    def get_seconds_until_next(self, now: datetime) -> float:
+        if not self.queue:
+            return math.inf
+        return max((self.queue[0][0] - now).total_seconds(), 0)
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--poll-seconds",
+            action="store",
+            default=30,
+            dest="poll_seconds",
+            type=int,
+            help="How often to check Triggers for changes while sleeping",
+        )
+        parser.add_argument(
+            "--verbose", action="store_true", default=False, dest="verbose"
+        )
+
+    def handle(self, *args, **options):
+        # This command replaces the per-minute cronjob: It stays resident,
+        # sleeps until the next Trigger is due and only then runs the
+        # sync_and_trigger_thermostats logic in-process.
+        poll_seconds: int = options["poll_seconds"]
+        verbose: bool = options["verbose"]
+
+        scheduler = TriggerScheduler()
+
+        # Pick up Triggers of the current minute, just like the cronjob would.
+        processed_until = timezone.localtime() - timedelta(minutes=1)
+        scheduler.reload(after=processed_until)
+        if verbose:
+            logger.info(f"Scheduler started with {len(scheduler.queue)} Triggers")
+
+        # Catch up on what was missed while down, the command knows since when.
+        last_processed_at = get_processed_until()
+        if last_processed_at is not None and last_processed_at < processed_until:
+            if verbose:
+                logger.info(f"Catching up on Triggers missed since {last_processed_at}")
+            try:
+                call_command("sync_and_trigger_thermostats", verbose=verbose)
+            except Exception:
+                logger.exception("Catching up on missed Triggers failed")
+
+        while True:
+            close_old_connections()
+            try:
+                if scheduler.reload_if_changed(after=processed_until) and verbose:
+                    logger.info(
+                        f"Triggers changed, reloaded {len(scheduler.queue)} Triggers"
+                    )
+
+                now = timezone.localtime()
+                due = scheduler.pop_due(now)
+                if due:
+                    self.fire(due, now=now, verbose=verbose)
+                    processed_until = now
+                    scheduler.reschedule(
+                        [trigger_id for _, trigger_id in due], after=now
+                    )
+                    # Firing may have disabled one-off Triggers.
+                    scheduler.reload_if_changed(after=processed_until)
+            except Exception:
+                logger.exception("Scheduler iteration failed")
+
+            now = timezone.localtime()
+            time.sleep(min(scheduler.get_seconds_until_next(now), poll_seconds))
+
+    def fire(self, due: list, now: datetime, verbose: bool = False):
+        # Widen the window if we woke up late, so nothing due gets lost.
+        oldest_fire_at = due[0][0]
+        minutes = max(math.ceil((now - oldest_fire_at).total_seconds() / 60), 1)
+        if verbose:
+            logger.info(f"{len(due)} Trigger(s) due, executing within {minutes}m")
+        call_command(
+            "sync_and_trigger_thermostats", minutes=minutes, verbose=verbose
+        )
@@ -0,0 +1,55 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from fritzbox_thermostat_triggers.triggers.notifications import PushoverClient
+from fritzbox_thermostat_triggers.triggers.notifications import deliver_push_notifications
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            default=False,
+            dest="loop",
+            help="Keep running and deliver new notifications as they come in",
+        )
+        parser.add_argument(
+            "--interval-seconds",
+            action="store",
+            default=5,
+            dest="interval_seconds",
+            type=int,
+        )
+        parser.add_argument(
+            "--verbose", action="store_true", default=False, dest="verbose"
+        )
+
+    def handle(self, *args, **options):
+        loop: bool = options["loop"]
+        interval_seconds: int = options["interval_seconds"]
+        verbose: bool = options["verbose"]
+
+        # Reuse one connection for as long as we are running.
+        client = PushoverClient()
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    sent_count = deliver_push_notifications(client)
+                    if sent_count and verbose:
+                        logger.info(f"Sent {sent_count} push notification(s)")
+                except Exception:
+                    if not loop:
+                        raise
+                    logger.exception("Failed to deliver push notifications")
+                if not loop:
+                    break
+                time.sleep(interval_seconds)
+        finally:
+            client.close()
@@ -1,19 +1,34 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from datetime import timedelta
 from typing import Optional
-import http.client
+import fcntl
 import logging
-import urllib.parse
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
 
-from pyfritzhome import Fritzhome
+from fritzbox_thermostat_triggers.triggers.fritzbox import get_fritzbox_circuit_breaker
+from fritzbox_thermostat_triggers.triggers.fritzbox import get_fritzbox_connection
+from fritzbox_thermostat_triggers.triggers.metrics import DELAY_BUCKETS
+from fritzbox_thermostat_triggers.triggers.metrics import RunMetrics
+from fritzbox_thermostat_triggers.triggers.metrics import save_metrics
+from fritzbox_thermostat_triggers.triggers.models import PushNotification
 from fritzbox_thermostat_triggers.triggers.models import Thermostat
 from fritzbox_thermostat_triggers.triggers.models import ThermostatLog
 from fritzbox_thermostat_triggers.triggers.models import Trigger
+from fritzbox_thermostat_triggers.triggers.notifications import build_push_notifications
+from fritzbox_thermostat_triggers.triggers.notifications import deliver_push_notifications
+from fritzbox_thermostat_triggers.triggers.schedule import get_processing_window_start
+from fritzbox_thermostat_triggers.triggers.schedule import refresh_schedule_file
+from fritzbox_thermostat_triggers.triggers.schedule import refresh_schedule_file_if_expired
+from fritzbox_thermostat_triggers.triggers.schedule import store_processed_until
 
 logger = logging.getLogger(__name__)
 
@@ -34,42 +49,191 @@ def temperatures_equal(t1, t2):
     return t1 == t2
 
 
-def get_fritzbox_connection(
-    host=settings.FRITZBOX_HOST,
-    user=settings.FRITZBOX_USER,
-    password=settings.FRITZBOX_PASSWORD,
-):
-    fritzbox = Fritzhome(host, user, password)
-    fritzbox.login()
-    return fritzbox
-
-
 def get_fritzbox_thermostat_devices():
     fritzbox = get_fritzbox_connection()
-    return [device for device in fritzbox.get_devices() if device.has_thermostat]
+    return fritzbox.get_thermostat_devices()
+
+
+def is_device_sync_due(now: datetime, max_age: timedelta) -> bool:
+    """Return whether to download the device list to find new and renamed ones.
+
+    A sync reads the target temperatures of all devices, so a Thermostat that
+    was not read for given max_age tells that the last sync is that old.
+    """
+    return Thermostat.objects.filter(
+        Q(target_temperature_read_at__isnull=True)
+        | Q(target_temperature_read_at__lt=now - max_age)
+    ).exists()
+
+
+class ExecutionBatch:
+    """Collect database writes of executed Triggers to commit them at once.
+
+    On SQLite each write is its own transaction otherwise, so a single
+    commit per run spares fsyncs and keeps the database locked shorter.
+    """
+
+    def __init__(self, merge_notifications: bool = False):
+        self.logs: list = []
+        self.disabled_triggers: list = []
+        self.recurring_triggers: list = []
+        self.changed_thermostats: dict = {}
+        self.messages: list = []  # Of (message, title).
+        self.merge_notifications = merge_notifications
+
+    def add(
+        self,
+        thermostat: Thermostat,
+        trigger: Trigger,
+        temperature: float,
+        no_op: bool = False,
+        verbose: bool = False,
+        scheduled_for: Optional[datetime] = None,
+        acknowledged_at: Optional[datetime] = None,
+        suppressed: bool = False,
+    ):
+        delay_seconds = None
+        if scheduled_for is not None and not suppressed:
+            acknowledged_at = acknowledged_at or timezone.now()
+            delay_seconds = (acknowledged_at - scheduled_for).total_seconds()
+        self.logs.append(
+            ThermostatLog(
+                delay_seconds=delay_seconds,
+                no_op=no_op,
+                scheduled_for=scheduled_for,
+                suppressed=suppressed,
+                temperature=temperature,
+                thermostat=thermostat,
+                trigger=trigger,
+            )
+        )
+        trigger.last_executed_no_op = no_op
+        if not no_op and not suppressed:
+            # We just set it, so this is as fresh as reading it from the box.
+            thermostat.target_temperature = temperature
+            thermostat.target_temperature_read_at = timezone.now()
+            self.changed_thermostats[thermostat.id] = thermostat
+        if trigger.recurring:
+            self.recurring_triggers.append(trigger)
+        else:
+            if verbose:
+                logger.info(f"Disabling non-recurring trigger {trigger}")
+            trigger.enabled = False
+            trigger.next_fire_at = None
+            trigger.updated_at = timezone.now()
+            self.disabled_triggers.append(trigger)
+
+    def add_notification(self, message: str, title: Optional[str] = None):
+        self.messages.append((message, title))
+
+    def commit(self):
+        notifications = build_push_notifications(
+            self.messages, merge=self.merge_notifications
+        )
+        if not self.logs and not notifications:
+            return
+        with transaction.atomic():
+            ThermostatLog.objects.bulk_create(self.logs)
+            for log in self.logs:
+                log.trigger.last_executed_at = log.created_at
+            for trigger in self.recurring_triggers:
+                # Past the occurrence just executed, so it is no longer due.
+                trigger.next_fire_at = trigger.get_next_fire_at(
+                    trigger.last_executed_at + timedelta(microseconds=1)
+                )
+            Trigger.objects.bulk_update(
+                self.disabled_triggers,
+                [
+                    "enabled",
+                    "next_fire_at",
+                    "last_executed_at",
+                    "last_executed_no_op",
+                    "updated_at",
+                ],
+            )
+            # Recurring Triggers stay as they are otherwise, which spares
+            # overwriting changes made in the meantime.
+            Trigger.objects.bulk_update(
+                self.recurring_triggers,
+                ["last_executed_at", "last_executed_no_op", "next_fire_at"],
+            )
+            Thermostat.objects.bulk_update(
+                self.changed_thermostats.values(),
+                ["target_temperature", "target_temperature_read_at"],
+            )
+            PushNotification.objects.bulk_create(notifications)
+            if self.disabled_triggers:
+                refresh_schedule_file()
+        self.logs = []
+        self.disabled_triggers = []
+        self.recurring_triggers = []
+        self.changed_thermostats = {}
+        self.messages = []
+
+
+def set_target_temperatures(
+    writes: list, max_concurrency: int = 1, acknowledged_at: Optional[list] = None
+) -> list:
+    """Send given (ain, temperature) writes to the Fritzbox.
+
+    Writes for different AINs go out concurrently, as each is a blocking
+    roundtrip that can take a second or more for DECT devices, while writes
+    for the same AIN keep their order. Return the exception (or None) for
+    each write, in the order of given writes. If a list is given as
+    acknowledged_at, it is filled with the time each write succeeded.
+    """
+    errors: list = [None] * len(writes)
+    if acknowledged_at is not None:
+        acknowledged_at[:] = [None] * len(writes)
+    if not writes:
+        return errors
+
+    indices_by_ain = defaultdict(list)
+    for index, (ain, _) in enumerate(writes):
+        indices_by_ain[ain].append(index)
+
+    try:
+        fritzbox = get_fritzbox_connection()
+    except Exception as error:
+        return [error] * len(writes)
+
+    def write_device(indices: list):
+        for index in indices:
+            ain, temperature = writes[index]
+            try:
+                fritzbox.set_target_temperature(ain, temperature)
+            except Exception as error:
+                errors[index] = error
+                continue
+            if acknowledged_at is not None:
+                acknowledged_at[index] = timezone.now()
 
+    max_workers = max(min(max_concurrency, len(indices_by_ain)), 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(pool.map(write_device, indices_by_ain.values()))
+    return errors
 
-def send_push_notification(message: str, title: Optional[str] = None):
-    if not settings.PUSHOVER_USER_KEY or not settings.PUSHOVER_API_TOKEN:
-        return
 
-    # https://support.pushover.net/i44-example-code-and-pushover-libraries#python
-    conn = http.client.HTTPSConnection("api.pushover.net:443")
-    conn.request(
-        "POST",
-        "/1/messages.json",
-        urllib.parse.urlencode(
-            {
-                "message": message,
-                "title": title,
-                "token": settings.PUSHOVER_API_TOKEN,
-                "user": settings.PUSHOVER_USER_KEY,
-            }
+def notify_temperature_changed(
+    batch: ExecutionBatch,
+    thermostat: Thermostat,
+    new_target_temperature: float,
+    verbose: bool = False,
+):
+    message = (
+        f"Triggered: {thermostat.name} is now set to "
+        f"{describe_temperature(new_target_temperature)}"
+    )
+    if verbose:
+        logger.info(message)
+        logger.info("Queueing PUSH notification")
+    batch.add_notification(
+        message,
+        title=(
+            f"{thermostat.name} -> "
+            f"{describe_temperature(new_target_temperature)}"
         ),
-        {"Content-type": "application/x-www-form-urlencoded"},
     )
-    response = conn.getresponse()
-    return response
 
 
 def change_thermostat_target_temperature(
@@ -80,80 +244,231 @@ def change_thermostat_target_temperature(
     notify: bool = True,
     verbose: bool = False,
 ):
-    ThermostatLog.objects.create(
-        no_op=no_op,
-        temperature=new_target_temperature,
-        thermostat=thermostat,
-        trigger=trigger,
-    )
+    """Set the temperature on the device and record the execution.
 
-    if not trigger.recurring:
-        if verbose:
-            logger.info(f"Disabling non-recurring trigger {trigger}")
-        trigger.enabled = False
-        trigger.save(update_fields=["enabled"])
+    If talking to the device fails, nothing is recorded.
+    """
+    if not no_op:
+        fritzbox = get_fritzbox_connection()
+        fritzbox.set_target_temperature(thermostat.ain, new_target_temperature)
 
-    if no_op:
-        return
-
-    fritzbox = get_fritzbox_connection()
-    fritzbox.set_target_temperature(thermostat.ain, new_target_temperature)
-
-    message = (
-        f"Triggered: {thermostat.name} is now set to "
-        f"{describe_temperature(new_target_temperature)}"
+    batch = ExecutionBatch()
+    batch.add(
+        thermostat, trigger, new_target_temperature, no_op=no_op, verbose=verbose
     )
-    if verbose:
-        logger.info(message)
+    if notify and not no_op:
+        notify_temperature_changed(batch, thermostat, new_target_temperature, verbose)
+    batch.commit()
+
+
+def sync_thermostats(devices: list, verbose: bool = False) -> dict:
+    """Create and rename Thermostats to match given devices in bulk.
+
+    The target temperatures of the devices are remembered along the way.
+    Return all known Thermostats by AIN. Thermostats whose device has
+    disappeared are reported, but kept along with their Triggers and logs.
+    """
+    thermostats_by_ain = {
+        thermostat.ain: thermostat for thermostat in Thermostat.objects.all()
+    }
+    now = timezone.now()
+
+    new_thermostats = []
+    known_thermostats = []
+    for device in devices:
+        thermostat = thermostats_by_ain.get(device.ain)
+        if thermostat is None:
+            new_thermostats.append(
+                Thermostat(
+                    ain=device.ain,
+                    name=device.name,
+                    target_temperature=device.target_temperature,
+                    target_temperature_read_at=now,
+                )
+            )
+            continue
 
-    if notify:
-        if verbose:
-            logger.info("Sending PUSH notification")
-        send_push_notification(
-            message,
-            title=(
-                f"{thermostat.name} -> "
-                f"{describe_temperature(new_target_temperature)}"
-            ),
+        # Sync name to reflect eventual changes from the fritzbox admin UI.
+        if thermostat.name != device.name:
+            if verbose:
+                logger.info(
+                    f"Thermostat name updated: {thermostat.name} -> {device.name}"
+                )
+            thermostat.name = device.name
+            thermostat.updated_at = now
+        thermostat.target_temperature = device.target_temperature
+        thermostat.target_temperature_read_at = now
+        known_thermostats.append(thermostat)
+
+    if new_thermostats:
+        Thermostat.objects.bulk_create(new_thermostats)
+        refresh_schedule_file()  # A sync may no longer be needed.
+        for thermostat in new_thermostats:
+            thermostats_by_ain[thermostat.ain] = thermostat
+            if verbose:
+                logger.info(f"New Thermostat created: {thermostat}")
+    if known_thermostats:
+        Thermostat.objects.bulk_update(
+            known_thermostats,
+            ["name", "target_temperature", "target_temperature_read_at", "updated_at"],
         )
 
+    device_ains = {device.ain for device in devices}
+    for ain, thermostat in thermostats_by_ain.items():
+        if ain not in device_ains:
+            logger.warning(f"Thermostat {thermostat} is no longer known to Fritzbox")
+
+    return thermostats_by_ain
+
+
+def read_target_temperatures(
+    thermostats: list, max_age: timedelta, now: Optional[datetime] = None
+) -> dict:
+    """Make sure the target temperatures of given Thermostats are fresh.
+
+    Only the stale ones are read from the Fritzbox, with a request per
+    device instead of downloading the whole device list. Return the error
+    of each Thermostat that could not be read, by id.
+    """
+    now = now or timezone.now()
+    fritzbox = None
+    errors = {}
+    refreshed_thermostats = []
+    for thermostat in thermostats:
+        if thermostat.has_fresh_target_temperature(max_age, now=now):
+            continue
+        try:
+            fritzbox = fritzbox or get_fritzbox_connection()
+            temperature = fritzbox.get_target_temperature(thermostat.ain)
+        except Exception as error:
+            errors[thermostat.id] = error
+            continue
+        thermostat.target_temperature = temperature
+        thermostat.target_temperature_read_at = now
+        refreshed_thermostats.append(thermostat)
+    Thermostat.objects.bulk_update(
+        refreshed_thermostats, ["target_temperature", "target_temperature_read_at"]
+    )
+    return errors
 
-query_any_recur_on = (
-    Q(recur_on_monday=True)
-    | Q(recur_on_tuesday=True)
-    | Q(recur_on_wednesday=True)
-    | Q(recur_on_thursday=True)
-    | Q(recur_on_friday=True)
-    | Q(recur_on_saturday=True)
-    | Q(recur_on_sunday=True)
-)
 
+def advance_stale_triggers(recently: datetime) -> int:
+    """Move next_fire_at of Triggers whose occurrence has passed on.
 
-def get_soon_non_recurring_triggers(recently: datetime, now: datetime) -> list:
-    return list(
-        Trigger.objects.exclude(query_any_recur_on).filter(
-            enabled=True, time__gte=recently, time__lte=now
-        )
+    Recurring Triggers continue with their next occurrence, outdated one-off
+    Triggers will not fire anymore. Return the number of updated Triggers.
+    """
+    stale_triggers = list(
+        Trigger.objects.filter(enabled=True, next_fire_at__lt=recently)
     )
+    for trigger in stale_triggers:
+        trigger.next_fire_at = trigger.get_next_fire_at(recently)
+    Trigger.objects.bulk_update(stale_triggers, ["next_fire_at"])
+    if stale_triggers:
+        refresh_schedule_file()
+    return len(stale_triggers)
+
+
+@contextmanager
+def acquire_run_lock(path: str):
+    """Yield whether this is the only run, which it stays until exiting."""
+    if not path:
+        yield True
+        return
+    with open(path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        # Released along with closing the file, also if the process dies.
+        yield True
+
+
+def describe_circuit_open_until(open_until: float) -> str:
+    until = datetime.fromtimestamp(open_until, tz=timezone.get_current_timezone())
+    return f"Fritzbox unreachable, leaving it alone until {until:%H:%M:%S}"
+
+
+def collapse_missed_triggers(
+    triggers_by_thermostat_id: dict,
+    fire_at_by_trigger_id: dict,
+    missed_before: datetime,
+) -> list:
+    """Keep only the latest of the Triggers missed per Thermostat.
+
+    Triggers firing before missed_before were missed by earlier runs, e.g.
+    during a downtime. Replaying each would be a burst of stale writes, so
+    only the latest target is applied, or none if a Trigger of the regular
+    window follows anyway. Return the superseded Triggers.
+    """
+    superseded = []
+    for thermostat_id, triggers in triggers_by_thermostat_id.items():
+        missed = [
+            trigger
+            for trigger in triggers
+            if fire_at_by_trigger_id[trigger.id] < missed_before
+        ]
+        if not missed:
+            continue
+        kept = [trigger for trigger in triggers if trigger not in missed]
+        if not kept:
+            kept = [
+                max(
+                    missed,
+                    key=lambda trigger: (fire_at_by_trigger_id[trigger.id], trigger.id),
+                )
+            ]
+        superseded.extend(trigger for trigger in triggers if trigger not in kept)
+        triggers_by_thermostat_id[thermostat_id] = kept
+    return superseded
+
+
+def resolve_conflicting_triggers(
+    triggers_by_thermostat_id: dict, fire_at_by_trigger_id: dict
+) -> list:
+    """Keep a single effective Trigger per Thermostat, return the others.
+
+    Only the last write to a device would stick anyway, so the others are
+    suppressed instead of sent: One-off Triggers beat recurring ones, as
+    they are meant as overrides, and later ones beat earlier ones.
+    """
+    suppressed = []
+    for thermostat_id, triggers in triggers_by_thermostat_id.items():
+        effective = max(
+            triggers,
+            key=lambda trigger: (
+                not trigger.recurring,
+                fire_at_by_trigger_id[trigger.id],
+                trigger.id,
+            ),
+        )
+        suppressed.extend(trigger for trigger in triggers if trigger is not effective)
+        triggers_by_thermostat_id[thermostat_id] = [effective]
+    return suppressed
 
 
-def get_soon_recurring_triggers(recently: datetime, now: datetime) -> list:
-    recurring_triggers = []
+def get_due_triggers(recently: datetime, now: datetime) -> list:
+    """Return enabled Triggers of both kinds that fire within given window."""
+    return list(
+        Trigger.objects.filter(
+            enabled=True, next_fire_at__gte=recently, next_fire_at__lte=now
+        ).order_by("next_fire_at", "id")
+    )
 
-    for trigger in Trigger.objects.filter(query_any_recur_on, enabled=True).distinct():
-        if not trigger.recurs_for_weekday_index(now.weekday()):
-            continue
 
-        # Ignore the specific date, check only time and weekday.
-        trigger_time_only = trigger.get_normalized_time().time()
+def get_soon_non_recurring_triggers(recently: datetime, now: datetime) -> list:
+    return [
+        trigger
+        for trigger in get_due_triggers(recently, now)
+        if not trigger.recurring
+    ]
 
-        if trigger_time_only < recently.time():
-            continue
-        if trigger_time_only > now.time():
-            continue
-        recurring_triggers.append(trigger)
 
-    return recurring_triggers
+def get_soon_recurring_triggers(recently: datetime, now: datetime) -> list:
+    return [
+        trigger for trigger in get_due_triggers(recently, now) if trigger.recurring
+    ]
 
 
 class Command(BaseCommand):
@@ -164,99 +479,276 @@ class Command(BaseCommand):
         parser.add_argument(
             "--sync-only", action="store_true", default=False, dest="sync_only"
         )
+        parser.add_argument(
+            "--max-concurrency",
+            action="store",
+            default=settings.FRITZBOX_MAX_CONCURRENT_WRITES,
+            dest="max_concurrency",
+            type=int,
+            help="How many devices to write to at the same time",
+        )
         parser.add_argument(
             "--verbose", action="store_true", default=False, dest="verbose"
         )
 
     def handle(self, *args, **options):
+        # Runs waiting for a slow Fritzbox would otherwise pile up and
+        # compete for the database.
+        with acquire_run_lock(settings.TRIGGER_RUN_LOCK_PATH) as is_only_run:
+            if not is_only_run:
+                logger.warning("Previous run still in progress, skipping this one")
+                return
+            self.run(**options)
+
+    def run(self, **options):
+        # Recorded for each run, also the ones that fail or do nothing.
+        metrics = RunMetrics()
+        now = timezone.localtime()
+        try:
+            with metrics.phase("total"):
+                self.sync_and_trigger(metrics, now, **options)
+            # Failed Triggers are retried by the next run, as it looks back
+            # to the last run that succeeded.
+            if not options["sync_only"]:
+                store_processed_until(now)
+        finally:
+            metrics.finish()
+            save_metrics(metrics)
+            refresh_schedule_file_if_expired()
+            if options["verbose"]:
+                logger.info(f"Run phases: {metrics.describe()}")
+
+    def sync_and_trigger(self, metrics: RunMetrics, now: datetime, **options):
         # This command is assumed to be run every minute as a cronjob.
         # Triggers are skipped if already executed within last interval.
         interval_minutes: int = options["minutes"]
         sync_only: bool = options["sync_only"]
+        max_concurrency: int = options["max_concurrency"]
         verbose: bool = options["verbose"]
 
-        now = timezone.localtime()
         within_last_interval = now - timedelta(minutes=interval_minutes)
+        # Reaches further back after a downtime, to catch up in one go.
+        window_start = get_processing_window_start(now, interval_minutes)
+        if window_start < within_last_interval and verbose:
+            logger.info(f"Catching up on Triggers missed since {window_start}")
 
-        non_recurring_triggers = get_soon_non_recurring_triggers(
-            recently=within_last_interval, now=now
-        )
-        recurring_triggers = get_soon_recurring_triggers(
-            recently=within_last_interval, now=now
-        )
-        triggers = non_recurring_triggers + recurring_triggers
-        thermostats_fetched_already: bool = Thermostat.objects.count() > 0
+        with metrics.phase("advance_stale_triggers"):
+            advanced_count = advance_stale_triggers(recently=window_start)
+        if advanced_count and verbose:
+            logger.info(f"Advanced next fire time of {advanced_count} Triggers")
+
+        with metrics.phase("get_due_triggers"):
+            triggers = get_due_triggers(recently=window_start, now=now)
 
         # Quick sanity check to save device battery life: If there are
         # no relevant Triggers at all, no need to talk to devices.
-        if not sync_only and not triggers and thermostats_fetched_already:
+        if not sync_only and not triggers and Thermostat.objects.exists():
             if verbose:
                 logger.info("No Triggers found, Thermostats seem okay, do nothing")
             return
 
-        for device in get_fritzbox_thermostat_devices():
-            # Create new Device if found.
-            thermostat, created = Thermostat.objects.get_or_create(ain=device.ain)
-            if created and verbose:
-                logger.info(f"New Thermostat created: {thermostat}")
+        # Only download the whole device list when asked to or to find the
+        # Thermostats to begin with, otherwise the cache serves most runs.
+        circuit_open_until = get_fritzbox_circuit_breaker().get_open_until()
+        if sync_only or not triggers:
+            if circuit_open_until is not None:
+                raise CommandError(
+                    f"{describe_circuit_open_until(circuit_open_until)}, "
+                    f"skipping the sync"
+                )
+            with metrics.phase("get_devices"):
+                devices = get_fritzbox_thermostat_devices()
+            with metrics.phase("sync_thermostats"):
+                sync_thermostats(devices, verbose=verbose)
+            return
 
-            # Sync name to reflect eventual changes from the fritzbox admin UI.
-            if created or thermostat.name != device.name:
-                old_name = thermostat.name
-                thermostat.name = device.name
-                thermostat.save(update_fields=["name"])
+        # Group upfront, so the number of queries does not grow with the
+        # number of Triggers or devices. Recent executions are looked up on
+        # the Triggers themselves.
+        triggers_by_thermostat_id = defaultdict(list)
+        fire_at_by_trigger_id = {}
+        for trigger in triggers:
+            # Of several missed occurrences, only the last one matters.
+            fire_at = trigger.get_last_fire_at(now)
+            if trigger.recurring and (
+                trigger.has_already_executed_within(interval_minutes)
+                or (trigger.last_executed_at and trigger.last_executed_at >= fire_at)
+            ):
                 if verbose:
                     logger.info(
-                        f"Thermostat name updated: {old_name} -> {thermostat.name}"
+                        f"Recurring {trigger} already executed recently, "
+                        f"skipping it..."
                     )
-
-            if sync_only:
                 continue
+            fire_at_by_trigger_id[trigger.id] = fire_at
+            triggers_by_thermostat_id[trigger.thermostat_id].append(trigger)
+        if not triggers_by_thermostat_id:
+            return
+
+        # Collapse to one target per device, sparing writes that would be
+        # overwritten right away. The others are logged as suppressed.
+        suppressed = collapse_missed_triggers(
+            triggers_by_thermostat_id,
+            fire_at_by_trigger_id,
+            missed_before=within_last_interval,
+        )
+        suppressed += resolve_conflicting_triggers(
+            triggers_by_thermostat_id, fire_at_by_trigger_id
+        )
 
+        if circuit_open_until is not None:
+            # Let the box recover instead of waiting for it to time out.
+            description = describe_circuit_open_until(circuit_open_until)
+            skipped_count = 0
+            for thermostat_triggers in triggers_by_thermostat_id.values():
+                for trigger in thermostat_triggers:
+                    logger.warning(f"Skipped {trigger}: {description}")
+                    skipped_count += 1
+            metrics.count("executions_total", skipped_count, result="skipped")
+            raise CommandError(f"{skipped_count} Trigger(s) skipped")
+
+        device_sync_interval = timedelta(
+            seconds=settings.FRITZBOX_DEVICE_SYNC_INTERVAL_SECONDS
+        )
+        if is_device_sync_due(now, max_age=device_sync_interval):
+            # Now and then, also pick up new and renamed devices. The Triggers
+            # go ahead without, should the device list fail to download.
+            try:
+                with metrics.phase("get_devices"):
+                    devices = get_fritzbox_thermostat_devices()
+                with metrics.phase("sync_thermostats"):
+                    sync_thermostats(devices, verbose=verbose)
+            except Exception:
+                logger.exception("Failed to sync Thermostats")
+
+        with metrics.phase("read_target_temperatures"):
+            thermostats = list(
+                Thermostat.objects.filter(id__in=triggers_by_thermostat_id).order_by(
+                    "id"
+                )
+            )
+            read_errors = read_target_temperatures(
+                thermostats,
+                max_age=timedelta(seconds=settings.FRITZBOX_DEVICE_CACHE_TTL_SECONDS),
+                now=now,
+            )
+
+        executions = []  # Of (thermostat, trigger, no_op).
+        failed_triggers = []
+        thermostats_by_id = {thermostat.id: thermostat for thermostat in thermostats}
+        for thermostat in thermostats:
             # Trigger untriggered Triggers that need triggering, d'uh!
-            thermostat_triggers = [t for t in triggers if t.thermostat == thermostat]
-            for trigger in thermostat_triggers:
-                if trigger.recurring and trigger.has_already_executed_within(interval_minutes):
-                    if verbose:
-                        logger.info(
-                            f"Recurring {trigger} already executed recently, "
-                            f"skipping it..."
-                        )
-                    continue
-
-                no_op = False
-                if temperatures_equal(device.target_temperature, trigger.temperature):
-                    # Nothing to do: Spare the device request to save battery.
-                    no_op = True
-                    if verbose:
-                        logger.info(
-                            f"{trigger} target temperature {trigger.temperature} "
-                            f"already reached on {device}, not sending actual "
-                            f"request to save some battery..."
-                        )
-
-                change_thermostat_target_temperature(
-                    new_target_temperature=trigger.temperature,
-                    no_op=no_op,
-                    thermostat=thermostat,
-                    trigger=trigger,
-                    verbose=verbose,
+            (trigger,) = triggers_by_thermostat_id[thermostat.id]
+            trigger.thermostat = thermostat  # Spare the lazy lookup.
+            if thermostat.id in read_errors:
+                logger.error(
+                    f"Failed to execute {trigger}",
+                    exc_info=read_errors[thermostat.id],
                 )
+                failed_triggers.append(trigger)
+                continue
 
-
-def execute_trigger(trigger:Trigger):
-    no_op: bool = False
-    for device in get_fritzbox_thermostat_devices():
-        thermostat = Thermostat.objects.get(ain=device.ain)
-        if thermostat != trigger.thermostat:
-            continue
-
-        if temperatures_equal(device.target_temperature, trigger.temperature):
-            no_op = True
-        change_thermostat_target_temperature(
-            new_target_temperature=trigger.temperature,
-            no_op=no_op,
-            thermostat=thermostat,
-            trigger=trigger,
+            no_op = False
+            if temperatures_equal(thermostat.target_temperature, trigger.temperature):
+                # Nothing to do: Spare the device request to save battery.
+                no_op = True
+                if verbose:
+                    logger.info(
+                        f"{trigger} target temperature {trigger.temperature} "
+                        f"already reached on {thermostat}, not sending "
+                        f"actual request to save some battery..."
+                    )
+            executions.append((thermostat, trigger, no_op))
+
+        writes = [
+            (thermostat, trigger)
+            for thermostat, trigger, no_op in executions
+            if not no_op
+        ]
+        acknowledged_at: list = []
+        with metrics.phase("set_target_temperatures"):
+            errors = set_target_temperatures(
+                [
+                    (thermostat.ain, trigger.temperature)
+                    for thermostat, trigger in writes
+                ],
+                max_concurrency=max_concurrency,
+                acknowledged_at=acknowledged_at,
+            )
+        acknowledged_at_by_trigger = {}
+        for (_, trigger), error, written_at in zip(writes, errors, acknowledged_at):
+            acknowledged_at_by_trigger[trigger] = written_at
+            if error is not None:
+                # This one is neither logged nor disabled as it did not
+                # take effect, but the other Triggers still are.
+                logger.error(f"Failed to execute {trigger}", exc_info=error)
+                failed_triggers.append(trigger)
+
+        batch = ExecutionBatch(
+            merge_notifications=settings.PUSHOVER_MERGE_NOTIFICATIONS
         )
-        break
+        for thermostat, trigger, no_op in executions:
+            if trigger in failed_triggers:
+                continue
+            metrics.count("executions_total", result="no_op" if no_op else "write")
+            # How late the device got its temperature, or learned it had it.
+            batch.add(
+                thermostat,
+                trigger,
+                trigger.temperature,
+                no_op=no_op,
+                verbose=verbose,
+                scheduled_for=fire_at_by_trigger_id[trigger.id],
+                acknowledged_at=acknowledged_at_by_trigger.get(trigger),
+            )
+            metrics.observe(
+                "execution_delay_seconds",
+                batch.logs[-1].delay_seconds,
+                DELAY_BUCKETS,
+            )
+            if not no_op:
+                notify_temperature_changed(
+                    batch, thermostat, trigger.temperature, verbose
+                )
+        for trigger in suppressed:
+            (effective,) = triggers_by_thermostat_id[trigger.thermostat_id]
+            if effective in failed_triggers:
+                continue  # Retried along with the effective one.
+            trigger.thermostat = thermostats_by_id[trigger.thermostat_id]
+            if verbose:
+                logger.info(f"{trigger} suppressed by {effective}, not sending it")
+            metrics.count("executions_total", result="suppressed")
+            batch.add(
+                trigger.thermostat,
+                trigger,
+                trigger.temperature,
+                verbose=verbose,
+                scheduled_for=fire_at_by_trigger_id[trigger.id],
+                suppressed=True,
+            )
+        with metrics.phase("commit"):
+            batch.commit()
+
+        # Only now that all devices have been written to, talk to Pushover.
+        with metrics.phase("deliver_push_notifications"):
+            try:
+                deliver_push_notifications()
+            except Exception:
+                logger.exception("Failed to deliver push notifications")
+
+        if failed_triggers:
+            metrics.count("executions_total", len(failed_triggers), result="failed")
+            raise CommandError(f"{len(failed_triggers)} Trigger(s) failed")
+
+
+def execute_trigger(trigger: Trigger):
+    """Execute given Trigger right away, talking only to its own device."""
+    thermostat = trigger.thermostat
+    fritzbox = get_fritzbox_connection()
+    current_temperature = fritzbox.get_target_temperature(thermostat.ain)
+    change_thermostat_target_temperature(
+        new_target_temperature=trigger.temperature,
+        no_op=temperatures_equal(current_temperature, trigger.temperature),
+        thermostat=thermostat,
+        trigger=trigger,
+    )
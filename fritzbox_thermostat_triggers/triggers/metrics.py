@@ -0,0 +1,271 @@
+"""Timings and counts of the phases of a Trigger run, Prometheus style.
+
+Each run of sync_and_trigger_thermostats records how long its phases took,
+how many queries and Fritzbox requests they needed and how Triggers went.
+Runs are separate processes under cron, so their observations are merged
+into a state file, which the /metrics view serves and which can also be
+exported for the textfile collector of the node exporter.
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+import fcntl
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from fritzbox_thermostat_triggers.triggers import fritzbox
+from fritzbox_thermostat_triggers.triggers.schedule_file import write_atomically
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "thermostat_triggers"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+DELAY_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800)
+
+HELP = {
+    "phase_duration_seconds": "Time spent per phase of a Trigger run.",
+    "phase_queries": "Database queries per phase of a Trigger run.",
+    "phase_fritzbox_requests": "Fritzbox requests per phase of a Trigger run.",
+    "execution_delay_seconds": "From when Triggers were due until executed.",
+    "executions_total": (
+        "Triggers by whether they wrote, no-op, failed, skipped or were suppressed."
+    ),
+    "fritzbox_requests_total": "Requests sent to the Fritzbox by command.",
+    "runs_total": "Trigger runs recorded.",
+    "last_run_timestamp_seconds": "When the last Trigger run finished.",
+}
+
+
+def format_labels(**labels) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+def braced(labels: str) -> str:
+    return f"{{{labels}}}" if labels else ""
+
+
+class Histogram:
+    def __init__(self, buckets: tuple, counts=None, sum: float = 0, count: int = 0):
+        self.buckets = tuple(buckets)
+        self.counts = list(counts or [0] * len(self.buckets))
+        self.sum = sum
+        self.count = count
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram"):
+        if other.buckets != self.buckets:
+            # Buckets changed in between, older observations are dropped.
+            self.buckets, self.counts = other.buckets, list(other.counts)
+            self.sum, self.count = other.sum, other.count
+            return
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": self.buckets,
+            "counts": self.counts,
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Histogram":
+        return cls(data["buckets"], data["counts"], data["sum"], data["count"])
+
+
+class Metrics:
+    """Histograms, counters and gauges by name and formatted labels."""
+
+    def __init__(self):
+        self.histograms: dict = {}
+        self.counters: dict = {}
+        self.gauges: dict = {}
+
+    def observe(self, name: str, value: float, buckets: tuple, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = format_labels(**labels)
+        if key not in series:
+            series[key] = Histogram(buckets)
+        series[key].observe(value)
+
+    def count(self, name: str, amount: float = 1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = format_labels(**labels)
+        series[key] = series.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        self.gauges.setdefault(name, {})[format_labels(**labels)] = value
+
+    def merge(self, other: "Metrics"):
+        for name, series in other.histograms.items():
+            own = self.histograms.setdefault(name, {})
+            for key, histogram in series.items():
+                if key in own:
+                    own[key].merge(histogram)
+                else:
+                    own[key] = Histogram.from_dict(histogram.to_dict())
+        for name, series in other.counters.items():
+            own = self.counters.setdefault(name, {})
+            for key, value in series.items():
+                own[key] = own.get(key, 0) + value
+        for name, series in other.gauges.items():
+            self.gauges.setdefault(name, {}).update(series)
+
+    def to_dict(self) -> dict:
+        return {
+            "histograms": {
+                name: {key: histogram.to_dict() for key, histogram in series.items()}
+                for name, series in self.histograms.items()
+            },
+            "counters": self.counters,
+            "gauges": self.gauges,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Metrics":
+        metrics = cls()
+        metrics.histograms = {
+            name: {key: Histogram.from_dict(value) for key, value in series.items()}
+            for name, series in data.get("histograms", {}).items()
+        }
+        metrics.counters = data.get("counters", {})
+        metrics.gauges = data.get("gauges", {})
+        return metrics
+
+    def render(self) -> str:
+        """Return the Prometheus text exposition format."""
+        lines = []
+
+        def header(name: str, kind: str):
+            lines.append(f"# HELP {PREFIX}_{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+        for name, series in sorted(self.histograms.items()):
+            header(name, "histogram")
+            for key, histogram in sorted(series.items()):
+                separator = "," if key else ""
+                for bound, value in zip(histogram.buckets, histogram.counts):
+                    lines.append(
+                        f"{PREFIX}_{name}_bucket"
+                        f'{{{key}{separator}le="{bound}"}} {value}'
+                    )
+                lines.append(
+                    f'{PREFIX}_{name}_bucket{{{key}{separator}le="+Inf"}} '
+                    f"{histogram.count}"
+                )
+                lines.append(f"{PREFIX}_{name}_sum{braced(key)} {histogram.sum}")
+                lines.append(f"{PREFIX}_{name}_count{braced(key)} {histogram.count}")
+        for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+            for name, series in sorted(metrics.items()):
+                header(name, kind)
+                for key, value in sorted(series.items()):
+                    lines.append(f"{PREFIX}_{name}{braced(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class RunMetrics(Metrics):
+    """Metrics of a single Trigger run, recorded phase by phase."""
+
+    def __init__(self):
+        super().__init__()
+        self.request_counts_at_start = fritzbox.request_counts.copy()
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the enclosed code, counting its queries and Fritzbox requests.
+
+        Phases may be nested, e.g. within one covering the whole run.
+        """
+        query_count = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal query_count
+            query_count += 1
+            return execute(sql, params, many, context)
+
+        requests_before = sum(fritzbox.request_counts.values())
+        started_at = time.monotonic()
+        try:
+            with connection.execute_wrapper(count_query):
+                yield
+        finally:
+            duration = time.monotonic() - started_at
+            requests = sum(fritzbox.request_counts.values()) - requests_before
+            self.observe(
+                "phase_duration_seconds", duration, DURATION_BUCKETS, phase=name
+            )
+            self.observe("phase_queries", query_count, COUNT_BUCKETS, phase=name)
+            self.observe(
+                "phase_fritzbox_requests", requests, COUNT_BUCKETS, phase=name
+            )
+
+    def finish(self):
+        """Record the totals of the run, once it is over."""
+        requests = fritzbox.request_counts - self.request_counts_at_start
+        for command, amount in requests.items():
+            self.count("fritzbox_requests_total", amount, command=command)
+        self.count("runs_total")
+        self.set("last_run_timestamp_seconds", time.time())
+
+    def describe(self) -> str:
+        """Return a line summing up the phases, for logging."""
+        durations = self.histograms.get("phase_duration_seconds", {})
+        queries = self.histograms.get("phase_queries", {})
+        requests = self.histograms.get("phase_fritzbox_requests", {})
+        parts = []
+        for key, histogram in durations.items():
+            phase = key.split('"')[1]
+            parts.append(
+                f"{phase} {histogram.sum * 1000:.0f}ms, "
+                f"{queries[key].sum:.0f} queries, {requests[key].sum:.0f} requests"
+            )
+        return "; ".join(parts)
+
+
+def get_state_path() -> Optional[Path]:
+    return Path(settings.METRICS_STATE_PATH) if settings.METRICS_STATE_PATH else None
+
+
+def load_metrics() -> Metrics:
+    path = get_state_path()
+    if path is None:
+        return Metrics()
+    try:
+        return Metrics.from_dict(json.loads(path.read_text()))
+    except (OSError, ValueError, KeyError):
+        return Metrics()
+
+
+def save_metrics(run: Metrics):
+    """Merge the metrics of a run into the state file and textfile."""
+    path = get_state_path()
+    if path is None:
+        return
+    try:
+        # Several processes may finish at once, don't lose their updates.
+        with open(path.with_name(path.name + ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            metrics = load_metrics()
+            metrics.merge(run)
+            write_atomically(str(path), json.dumps(metrics.to_dict()).encode())
+            if settings.METRICS_TEXTFILE_PATH:
+                write_atomically(
+                    settings.METRICS_TEXTFILE_PATH, metrics.render().encode()
+                )
+    except OSError:
+        logger.warning(f"Could not write metrics to {path}")
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:43
+
+from datetime import datetime
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# Frozen copies of the model helpers as of this migration, so that changing
+# those later doesn't change what it does.
+WEEKDAY_FIELD_NAMES = (
+    "recur_on_monday",
+    "recur_on_tuesday",
+    "recur_on_wednesday",
+    "recur_on_thursday",
+    "recur_on_friday",
+    "recur_on_saturday",
+    "recur_on_sunday",
+)
+
+
+def get_next_fire_at(time, weekday_flags, after):
+    current_timezone = timezone.get_current_timezone()
+    time_only = timezone.make_naive(time, current_timezone).time()
+    start_date = timezone.localtime(after).date()
+    for days in range(8):
+        date = start_date + timedelta(days=days)
+        if not weekday_flags[date.weekday()]:
+            continue
+        fire_at = timezone.make_aware(
+            datetime.combine(date, time_only), current_timezone
+        )
+        if fire_at >= after:
+            return fire_at
+    return None
+
+
+def backfill_next_fire_at(apps, schema_editor):
+    Trigger = apps.get_model("triggers", "Trigger")
+    after = timezone.localtime() - timedelta(minutes=1)
+    triggers = list(Trigger.objects.filter(enabled=True))
+    for trigger in triggers:
+        weekday_flags = tuple(getattr(trigger, name) for name in WEEKDAY_FIELD_NAMES)
+        if any(weekday_flags):
+            trigger.next_fire_at = get_next_fire_at(trigger.time, weekday_flags, after)
+        else:
+            trigger.next_fire_at = trigger.time
+    Trigger.objects.bulk_update(triggers, ["next_fire_at"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triggers', '0011_remove_thermostatlog_triggered_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trigger',
+            name='next_fire_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='trigger',
+            index=models.Index(fields=['enabled', 'next_fire_at'], name='trigger_enabled_next_fire_idx'),
+        ),
+        migrations.RunPython(backfill_next_fire_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triggers', '0013_pushnotification'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='thermostatlog',
+            index=models.Index(fields=['created_at', 'id'], name='thermostatlog_created_id_idx'),
+        ),
+    ]
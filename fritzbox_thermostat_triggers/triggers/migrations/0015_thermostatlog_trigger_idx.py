@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triggers', '0014_thermostatlog_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='thermostatlog',
+            index=models.Index(fields=['trigger', 'created_at'], name='thermostatlog_trigger_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triggers', '0015_thermostatlog_trigger_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThermostatLogRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('date', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('no_op_count', models.PositiveIntegerField(default=0)),
+                ('last_temperature', models.FloatField()),
+                ('last_logged_at', models.DateTimeField()),
+                ('thermostat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='log_rollups', to='triggers.thermostat')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'id'], name='thermostatlogrollup_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('thermostat', 'date'), name='thermostatlogrollup_unique_day')],
+            },
+        ),
+    ]
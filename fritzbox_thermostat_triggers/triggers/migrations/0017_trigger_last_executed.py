@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:55
+
+from django.db import migrations, models
+from django.db.models import OuterRef
+from django.db.models import Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_last_executed(apps, schema_editor):
+    ThermostatLog = apps.get_model("triggers", "ThermostatLog")
+    Trigger = apps.get_model("triggers", "Trigger")
+    last_log = ThermostatLog.objects.filter(trigger=OuterRef("pk")).order_by(
+        "-created_at", "-id"
+    )
+    Trigger.objects.update(
+        last_executed_at=Subquery(last_log.values("created_at")[:1]),
+        last_executed_no_op=Coalesce(Subquery(last_log.values("no_op")[:1]), False),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triggers', '0016_thermostatlogrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trigger',
+            name='last_executed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trigger',
+            name='last_executed_no_op',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(backfill_last_executed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triggers', '0017_trigger_last_executed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thermostat',
+            name='target_temperature',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='thermostat',
+            name='target_temperature_read_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
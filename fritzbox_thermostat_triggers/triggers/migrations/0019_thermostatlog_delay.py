@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triggers', '0018_thermostat_target_temperature'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thermostatlog',
+            name='delay_seconds',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='thermostatlog',
+            name='scheduled_for',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
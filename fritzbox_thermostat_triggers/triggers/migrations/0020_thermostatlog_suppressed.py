@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triggers', '0019_thermostatlog_delay'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thermostatlog',
+            name='suppressed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
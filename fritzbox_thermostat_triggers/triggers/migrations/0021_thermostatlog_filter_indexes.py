@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('triggers', '0020_thermostatlog_suppressed'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='thermostatlog',
+            name='thermostatlog_trigger_idx',
+        ),
+        migrations.AddIndex(
+            model_name='thermostatlog',
+            index=models.Index(fields=['thermostat', 'created_at', 'id'], name='thermostatlog_thermostat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thermostatlog',
+            index=models.Index(fields=['trigger', 'created_at', 'id'], name='thermostatlog_trigger_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thermostatlog',
+            index=models.Index(condition=models.Q(('no_op', True), ('suppressed', True), _connector='OR'), fields=['created_at', 'id'], name='thermostatlog_no_effect_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thermostatlog',
+            index=models.Index(condition=models.Q(('no_op', False), ('suppressed', False)), fields=['created_at', 'id'], name='thermostatlog_effect_idx'),
+        ),
+    ]
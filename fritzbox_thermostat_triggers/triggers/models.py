@@ -1,5 +1,6 @@
 from datetime import datetime
 from datetime import timedelta
+from typing import Optional
 
 from django.core.validators import MaxValueValidator
 from django.core.validators import MinValueValidator
@@ -11,6 +12,83 @@ DATETIME_FULL_FORMAT = "%d.%m.%Y at %H:%M"
 DATE_ONLY_FORMAT = "%d.%m.%Y"
 TIME_ONLY_FORMAT = "%H:%M"
 
+WEEKDAY_FIELD_NAMES = (
+    "recur_on_monday",
+    "recur_on_tuesday",
+    "recur_on_wednesday",
+    "recur_on_thursday",
+    "recur_on_friday",
+    "recur_on_saturday",
+    "recur_on_sunday",
+)
+
+SCHEDULE_FIELD_NAMES = ("enabled", "time", *WEEKDAY_FIELD_NAMES)
+
+query_any_recur_on = (
+    models.Q(recur_on_monday=True)
+    | models.Q(recur_on_tuesday=True)
+    | models.Q(recur_on_wednesday=True)
+    | models.Q(recur_on_thursday=True)
+    | models.Q(recur_on_friday=True)
+    | models.Q(recur_on_saturday=True)
+    | models.Q(recur_on_sunday=True)
+)
+
+
+def get_next_fire_at(
+    time: datetime, weekday_flags: tuple, after: datetime
+) -> Optional[datetime]:
+    """Return the first time at or after given datetime to fire at.
+
+    Without weekday flags that is exactly the given time (if not passed),
+    otherwise the (local) time of day on each flagged weekday.
+    """
+    if not any(weekday_flags):
+        return time if time >= after else None
+
+    current_timezone = timezone.get_current_timezone()
+    time_only = timezone.make_naive(time, current_timezone).time()
+    start_date = timezone.localtime(after).date()
+
+    # Looking 8 days ahead covers today's time of day already being over.
+    for days in range(8):
+        date = start_date + timedelta(days=days)
+        if not weekday_flags[date.weekday()]:
+            continue
+        fire_at = timezone.make_aware(
+            datetime.combine(date, time_only), current_timezone
+        )
+        if fire_at >= after:
+            return fire_at
+    return None
+
+
+def get_last_fire_at(
+    time: datetime, weekday_flags: tuple, before: datetime
+) -> Optional[datetime]:
+    """Return the last time at or before given datetime to fire at.
+
+    The counterpart of get_next_fire_at, to tell which of several missed
+    occurrences was the latest.
+    """
+    if not any(weekday_flags):
+        return time if time <= before else None
+
+    current_timezone = timezone.get_current_timezone()
+    time_only = timezone.make_naive(time, current_timezone).time()
+    end_date = timezone.localtime(before).date()
+
+    for days in range(8):
+        date = end_date - timedelta(days=days)
+        if not weekday_flags[date.weekday()]:
+            continue
+        fire_at = timezone.make_aware(
+            datetime.combine(date, time_only), current_timezone
+        )
+        if fire_at <= before:
+            return fire_at
+    return None
+
 
 class BaseModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
@@ -24,6 +102,20 @@ class Thermostat(BaseModel):
     ain = models.CharField(max_length=64)
     name = models.CharField(max_length=128, default="", blank=True)
 
+    target_temperature = models.FloatField(null=True, blank=True, editable=False)
+    target_temperature_read_at = models.DateTimeField(
+        null=True, blank=True, editable=False
+    )
+    """Last known state of the device, to spare asking the Fritzbox."""
+
+    def has_fresh_target_temperature(
+        self, max_age: timedelta, now: Optional[datetime] = None
+    ) -> bool:
+        if self.target_temperature is None or not self.target_temperature_read_at:
+            return False
+        now = now or timezone.now()
+        return now - self.target_temperature_read_at < max_age
+
     def __str__(self):
         return self.name or self.ain
 
@@ -40,10 +132,99 @@ class ThermostatLog(BaseModel):
     no_op = models.BooleanField(default=False)
     """When True, no actual request was sent as temperate already matched."""
 
+    suppressed = models.BooleanField(default=False)
+    """When True, another Trigger of the same run won, nothing was sent."""
+
+    scheduled_for = models.DateTimeField(null=True, blank=True, editable=False)
+    """When the Trigger was due, empty for manual executions."""
+
+    delay_seconds = models.FloatField(null=True, blank=True, editable=False)
+    """From scheduled_for until the device acknowledged the temperature."""
+
+    class Meta:
+        indexes = [
+            # Supports keyset pagination of the logs page, newest first.
+            models.Index(
+                fields=["created_at", "id"], name="thermostatlog_created_id_idx"
+            ),
+            # Support the filters of the logs page, along the same keyset.
+            models.Index(
+                fields=["thermostat", "created_at", "id"],
+                name="thermostatlog_thermostat_idx",
+            ),
+            models.Index(
+                fields=["trigger", "created_at", "id"],
+                name="thermostatlog_trigger_idx",
+            ),
+            models.Index(
+                fields=["created_at", "id"],
+                condition=models.Q(no_op=True) | models.Q(suppressed=True),
+                name="thermostatlog_no_effect_idx",
+            ),
+            models.Index(
+                fields=["created_at", "id"],
+                condition=models.Q(no_op=False, suppressed=False),
+                name="thermostatlog_effect_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.thermostat}: {self.trigger}"
 
 
+class ThermostatLogRollup(BaseModel):
+    """Daily summary of the ThermostatLogs of a Thermostat, once compacted."""
+
+    thermostat = models.ForeignKey(
+        "triggers.Thermostat", related_name="log_rollups", on_delete=models.CASCADE
+    )
+    date = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    no_op_count = models.PositiveIntegerField(default=0)
+    last_temperature = models.FloatField()
+    last_logged_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["thermostat", "date"], name="thermostatlogrollup_unique_day"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["date", "id"], name="thermostatlogrollup_date_idx"),
+        ]
+
+    @property
+    def no_op_ratio(self) -> float:
+        return self.no_op_count / self.count if self.count else 0.0
+
+    def __str__(self):
+        return f"{self.thermostat}: {self.date}"
+
+
+class PushNotification(BaseModel):
+    """Outbox of Pushover messages, delivered apart from the Trigger runs."""
+
+    title = models.CharField(max_length=250, default="", blank=True)
+    message = models.TextField()
+
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(default="", blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["sent_at", "next_attempt_at"],
+                name="pushnotification_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return self.title or self.message
+
+
 class Trigger(BaseModel):
     thermostat = models.ForeignKey("triggers.Thermostat", on_delete=models.CASCADE)
     name = models.CharField(max_length=128, default="", blank=True)
@@ -64,6 +245,28 @@ class Trigger(BaseModel):
     recur_on_saturday = models.BooleanField(default=False)
     recur_on_sunday = models.BooleanField(default=False)
 
+    next_fire_at = models.DateTimeField(null=True, blank=True, editable=False)
+    """Denormalized from the fields above, to find due Triggers by index."""
+
+    last_executed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_executed_no_op = models.BooleanField(default=False, editable=False)
+    """Denormalized from the latest ThermostatLog, to spare looking it up."""
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["enabled", "next_fire_at"],
+                name="trigger_enabled_next_fire_idx",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.next_fire_at = self.compute_next_fire_at()
+        update_fields = kwargs.get("update_fields")
+        if update_fields and any(f in SCHEDULE_FIELD_NAMES for f in update_fields):
+            kwargs["update_fields"] = {*update_fields, "next_fire_at"}
+        super().save(*args, **kwargs)
+
     def execute(self):
         from fritzbox_thermostat_triggers.triggers.management.commands.sync_and_trigger_thermostats import execute_trigger  # noqa
         execute_trigger(self)
@@ -107,6 +310,23 @@ class Trigger(BaseModel):
     def get_normalized_time(self) -> datetime:
         return timezone.make_naive(self.time, timezone.get_current_timezone())
 
+    def get_next_fire_at(self, after: datetime) -> Optional[datetime]:
+        """Return the first time at or after given datetime this would fire."""
+        return get_next_fire_at(self.time, self.weekday_flags, after)
+
+    def get_last_fire_at(self, before: datetime) -> Optional[datetime]:
+        """Return the last time at or before given datetime this fired."""
+        return get_last_fire_at(self.time, self.weekday_flags, before)
+
+    def compute_next_fire_at(self, now: Optional[datetime] = None):
+        if not self.enabled:
+            return None
+        if not self.recurring:
+            return self.time
+        # Keep an occurrence of the last minute, a run may still pick it up.
+        now = now or timezone.localtime()
+        return self.get_next_fire_at(now - timedelta(minutes=1))
+
     def get_formatted_time(self, date_format: str = DATETIME_FULL_FORMAT) -> str:
         return self.get_normalized_time().strftime(date_format)
 
@@ -129,13 +349,12 @@ class Trigger(BaseModel):
 
     def has_already_executed_within(self, minutes: int) -> bool:
         threshold = timezone.localtime() - timedelta(minutes=minutes)
-        return self.logs.filter(created_at__gte=threshold)
+        return bool(self.last_executed_at and self.last_executed_at >= threshold)
 
-    def get_last_triggered_at(self, date_format: str = DATE_ONLY_FORMAT) -> bool:
-        last_log = self.logs.last()
-        if not last_log:
+    def get_last_triggered_at(self, date_format: str = DATE_ONLY_FORMAT) -> str:
+        if not self.last_executed_at:
             return ""
-        return last_log.created_at.strftime(date_format)
+        return timezone.localtime(self.last_executed_at).strftime(date_format)
 
     def __str__(self):
         formatted_time = self.get_formatted_time(
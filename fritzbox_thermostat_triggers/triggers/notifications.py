@@ -0,0 +1,216 @@
+"""Pushover notifications via an outbox.
+
+Trigger runs only write PushNotification rows, so a slow or failing
+Pushover API can neither delay nor break talking to the thermostats. The
+outbox is delivered afterwards over a single keep-alive connection, with
+failed messages retried with exponential backoff. A message Pushover may
+already have received is not retried, so it is never notified twice. Each
+message is claimed before sending, as runs and send_push_notifications may
+deliver at once.
+"""
+
+from datetime import timedelta
+from typing import Optional
+import http.client
+import logging
+import urllib.parse
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from fritzbox_thermostat_triggers.triggers.models import PushNotification
+
+logger = logging.getLogger(__name__)
+
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 60 * 60
+# How long a claimed message is left alone, should its sender die midway.
+CLAIM_SECONDS = 5 * 60
+
+
+class PushoverError(Exception):
+    pass
+
+
+class PushoverUncertainError(PushoverError):
+    """Raised when a message may or may not have reached Pushover."""
+
+
+class StaleConnectionError(Exception):
+    """Raised when a kept-alive connection was closed by the server."""
+
+
+def pushover_configured() -> bool:
+    return bool(settings.PUSHOVER_USER_KEY and settings.PUSHOVER_API_TOKEN)
+
+
+def build_push_notifications(messages: list, merge: bool = False) -> list:
+    """Return unsaved PushNotifications for given (message, title) tuples.
+
+    When merging, several messages are combined into a single notification.
+    """
+    if not pushover_configured() or not messages:
+        return []
+    if merge and len(messages) > 1:
+        return [
+            PushNotification(
+                title=f"{len(messages)} thermostats changed",
+                message="\n".join(message for message, _ in messages),
+            )
+        ]
+    return [
+        PushNotification(message=message, title=title or "")
+        for message, title in messages
+    ]
+
+
+class PushoverClient:
+    """Send messages to the Pushover API over one reused connection."""
+
+    def __init__(self, url: Optional[str] = None, timeout: float = 10):
+        parsed = urllib.parse.urlsplit(url or settings.PUSHOVER_API_URL)
+        self.connection_class = (
+            http.client.HTTPSConnection
+            if parsed.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.netloc = parsed.netloc
+        self.path = parsed.path
+        self.timeout = timeout
+        self.connection = None
+
+    def send(self, message: str, title: str = ""):
+        # https://support.pushover.net/i44-example-code-and-pushover-libraries#python
+        body = urllib.parse.urlencode(
+            {
+                "message": message,
+                "title": title,
+                "token": settings.PUSHOVER_API_TOKEN,
+                "user": settings.PUSHOVER_USER_KEY,
+            }
+        )
+        headers = {"Content-type": "application/x-www-form-urlencoded"}
+        try:
+            status, content = self._post(
+                body, headers, reused=self.connection is not None
+            )
+        except StaleConnectionError:
+            status, content = self._post(body, headers, reused=False)
+        if status >= 400:
+            raise PushoverError(f"HTTP {status}: {content[:200]}")
+
+    def _post(self, body: str, headers: dict, reused: bool) -> tuple:
+        try:
+            self._request(body, headers)
+        except (http.client.HTTPException, OSError) as error:
+            self.close()
+            if reused:
+                raise StaleConnectionError() from error
+            raise
+        try:
+            return self._read_response()
+        except (http.client.HTTPException, OSError) as error:
+            self.close()
+            # Reset without an answer: The server had dropped the idle
+            # connection instead of taking the request, try a new one.
+            if reused and isinstance(error, ConnectionResetError):
+                raise StaleConnectionError() from error
+            raise PushoverUncertainError(
+                f"No answer, the message may have arrived: {error!r}"
+            ) from error
+
+    def _request(self, body: str, headers: dict):
+        if self.connection is None:
+            self.connection = self.connection_class(self.netloc, timeout=self.timeout)
+        self.connection.request("POST", self.path, body, headers)
+
+    def _read_response(self) -> tuple:
+        response = self.connection.getresponse()
+        # Read the response fully, otherwise the connection can't be reused.
+        content = response.read().decode(errors="replace")
+        if response.will_close:
+            self.close()
+        return response.status, content
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def get_retry_delay(attempts: int) -> timedelta:
+    seconds = RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+    return timedelta(seconds=min(seconds, RETRY_MAX_SECONDS))
+
+
+def claim_push_notification(notification: PushNotification) -> bool:
+    """Take given PushNotification for sending, return whether we got it.
+
+    A conditional update lets only one of several delivering processes win.
+    The attempt counts right away, the claim expires after CLAIM_SECONDS.
+    """
+    now = timezone.now()
+    claimed = PushNotification.objects.filter(
+        id=notification.id,
+        sent_at__isnull=True,
+        next_attempt_at__lte=now,
+        attempts__lt=settings.PUSHOVER_MAX_ATTEMPTS,
+    ).update(
+        attempts=F("attempts") + 1,
+        next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS),
+        updated_at=now,
+    )
+    if claimed:
+        notification.refresh_from_db(fields=["attempts"])
+    return bool(claimed)
+
+
+def deliver_push_notifications(client: Optional[PushoverClient] = None) -> int:
+    """Send all pending PushNotifications that are due, return how many."""
+    if not pushover_configured():
+        return 0
+
+    now = timezone.now()
+    pending = PushNotification.objects.filter(
+        sent_at__isnull=True,
+        next_attempt_at__lte=now,
+        attempts__lt=settings.PUSHOVER_MAX_ATTEMPTS,
+    ).order_by("next_attempt_at", "id")
+
+    own_client = client is None
+    client = client or PushoverClient()
+    sent_count = 0
+    try:
+        for notification in pending:
+            if not claim_push_notification(notification):
+                continue  # Taken by another process meanwhile.
+            try:
+                client.send(notification.message, notification.title)
+            except PushoverUncertainError as error:
+                # Resending could notify twice, so it is taken as sent.
+                logger.warning(f"Push notification may not have been sent: {error}")
+                notification.last_error = str(error)
+                notification.sent_at = timezone.now()
+            except Exception as error:
+                logger.warning(f"Failed to send push notification: {error}")
+                notification.last_error = str(error)
+                notification.next_attempt_at = timezone.now() + get_retry_delay(
+                    notification.attempts
+                )
+            else:
+                notification.sent_at = timezone.now()
+                notification.last_error = ""
+                sent_count += 1
+            notification.save(
+                update_fields=[
+                    "last_error",
+                    "next_attempt_at",
+                    "sent_at",
+                    "updated_at",
+                ]
+            )
+    finally:
+        if own_client:
+            client.close()
+    return sent_count
@@ -0,0 +1,128 @@
+"""The schedule file of when Triggers are due, kept up to date.
+
+The week is split into one slot per minute. The minutes recurring Triggers
+fire in are written to the schedule file read by the launcher, along with
+the fire times of one-off Triggers.
+"""
+
+from datetime import datetime
+from datetime import timezone as dt_timezone
+from typing import Optional
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from fritzbox_thermostat_triggers.triggers import schedule_file
+from fritzbox_thermostat_triggers.triggers.models import Thermostat
+from fritzbox_thermostat_triggers.triggers.models import Trigger
+from fritzbox_thermostat_triggers.triggers.models import WEEKDAY_FIELD_NAMES
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def get_minute_of_week(value: datetime) -> int:
+    """Return 0 for Monday 00:00 up to 10079 for Sunday 23:59 (local time)."""
+    local = timezone.localtime(value)
+    return local.weekday() * MINUTES_PER_DAY + local.hour * 60 + local.minute
+
+
+def build_schedule_file(now: float) -> bytes:
+    recurring_minutes = set()
+    one_off_fire_times = []
+    rows = Trigger.objects.filter(enabled=True).values_list(
+        "time", "next_fire_at", *WEEKDAY_FIELD_NAMES
+    )
+    for trigger_time, next_fire_at, *weekday_flags in rows:
+        if any(weekday_flags):
+            minute_of_day = get_minute_of_week(trigger_time) % MINUTES_PER_DAY
+            recurring_minutes.update(
+                weekday * MINUTES_PER_DAY + minute_of_day
+                for weekday, flag in enumerate(weekday_flags)
+                if flag
+            )
+        elif next_fire_at is not None:
+            one_off_fire_times.append(next_fire_at.timestamp())
+    return schedule_file.pack_schedule(
+        recurring_minutes=recurring_minutes,
+        one_off_fire_times=one_off_fire_times,
+        time_zone=settings.TIME_ZONE,
+        expires_at=now + settings.TRIGGER_SCHEDULE_MAX_AGE_SECONDS,
+        needs_sync=not Thermostat.objects.exists(),
+    )
+
+
+def write_schedule_file():
+    """Write the schedule file for the launcher, if enabled."""
+    path = settings.TRIGGER_SCHEDULE_PATH
+    if not path:
+        return
+    try:
+        schedule_file.write_atomically(path, build_schedule_file(now=time.time()))
+    except OSError:
+        logger.warning(f"Could not write Trigger schedule to {path}")
+
+
+def refresh_schedule_file():
+    """Rewrite the schedule file once Triggers changed have been committed.
+
+    Bulk updates of Triggers bypass signals, so call this after those.
+    """
+    if settings.TRIGGER_SCHEDULE_PATH:
+        transaction.on_commit(write_schedule_file)
+
+
+def refresh_schedule_file_if_expired():
+    path = settings.TRIGGER_SCHEDULE_PATH
+    if path and schedule_file.is_expired(path, now=time.time()):
+        write_schedule_file()
+
+
+def get_processing_window_start(now: datetime, minutes: int) -> datetime:
+    """Return since when Triggers are due, including ones missed since the
+    last processed instant, e.g. during a downtime."""
+    start = schedule_file.get_window_start(
+        settings.TRIGGER_PROCESSED_UNTIL_PATH,
+        now=now.timestamp(),
+        minutes=minutes,
+        max_catch_up=settings.TRIGGER_CATCH_UP_MAX_SECONDS,
+    )
+    return timezone.localtime(datetime.fromtimestamp(start, tz=dt_timezone.utc))
+
+
+def get_processed_until() -> Optional[datetime]:
+    """Return up to when Triggers have been processed, if known."""
+    path = settings.TRIGGER_PROCESSED_UNTIL_PATH
+    timestamp = schedule_file.read_processed_until(path) if path else None
+    if timestamp is None:
+        return None
+    return timezone.localtime(datetime.fromtimestamp(timestamp, tz=dt_timezone.utc))
+
+
+def store_processed_until(now: datetime):
+    """Remember that all Triggers due until given time were processed."""
+    path = settings.TRIGGER_PROCESSED_UNTIL_PATH
+    if not path:
+        return
+    try:
+        schedule_file.write_processed_until(path, now.timestamp())
+    except OSError:
+        logger.warning(f"Could not write processed Triggers to {path}")
+
+
+@receiver(post_save, sender=Trigger)
+def refresh_schedule_file_on_save(sender, instance: Trigger, **kwargs):
+    refresh_schedule_file()
+
+
+@receiver(post_delete, sender=Trigger)
+def refresh_schedule_file_on_delete(sender, instance: Trigger, **kwargs):
+    refresh_schedule_file()
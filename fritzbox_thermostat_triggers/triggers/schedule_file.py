@@ -0,0 +1,183 @@
+"""Compact file of when Triggers are due, readable without Django.
+
+Written by the app whenever Triggers change, so that the launcher run by
+cron can tell within microseconds whether a run has anything to do, before
+paying for Django setup. Layout, in native byte order:
+
+- Header: magic, version, flags, expiry (epoch seconds), number of one-off
+  Triggers and the name of the time zone recurring Triggers are local to.
+- One bit per minute of the week, set if a recurring Trigger fires within.
+- Sorted fire times of one-off Triggers, in epoch seconds.
+
+Anything unexpected about the file errs on the side of running.
+
+Next to it, the instant up to which Triggers have been processed is kept
+as plain text, so runs after a downtime catch up on what they missed.
+"""
+
+from datetime import datetime
+from typing import Iterable
+from typing import Optional
+from zoneinfo import ZoneInfo
+import mmap
+import os
+import struct
+import tempfile
+
+MAGIC = b"FTTS"
+VERSION = 1
+HEADER = struct.Struct("=4sBBxxqI36s")
+FIRE_TIME = struct.Struct("=q")
+
+MINUTES_PER_WEEK = 7 * 24 * 60
+BITMAP_OFFSET = HEADER.size
+ONE_OFF_OFFSET = BITMAP_OFFSET + MINUTES_PER_WEEK // 8
+
+# Set while no Thermostat is known, which a run needs to sync first.
+FLAG_NEEDS_SYNC = 0x01
+
+
+def get_minute_of_week(timestamp: float, time_zone: ZoneInfo) -> int:
+    local = datetime.fromtimestamp(timestamp, time_zone)
+    return local.weekday() * 24 * 60 + local.hour * 60 + local.minute
+
+
+def pack_schedule(
+    recurring_minutes: Iterable[int],
+    one_off_fire_times: Iterable[float],
+    time_zone: str,
+    expires_at: float,
+    needs_sync: bool = False,
+) -> bytes:
+    bitmap = bytearray(MINUTES_PER_WEEK // 8)
+    for minute in recurring_minutes:
+        bitmap[minute // 8] |= 1 << (minute % 8)
+    fire_times = sorted(int(fire_time) for fire_time in one_off_fire_times)
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        FLAG_NEEDS_SYNC if needs_sync else 0,
+        int(expires_at),
+        len(fire_times),
+        time_zone.encode(),
+    )
+    return (
+        header
+        + bytes(bitmap)
+        + b"".join(FIRE_TIME.pack(fire_time) for fire_time in fire_times)
+    )
+
+
+def write_atomically(path: str, content: bytes):
+    """Replace the file at once, readers still see the old one until then."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(path)}"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def read_processed_until(path: str) -> Optional[float]:
+    """Return the epoch seconds up to which Triggers have been processed."""
+    try:
+        with open(path) as f:
+            return float(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def write_processed_until(path: str, timestamp: float):
+    write_atomically(path, repr(timestamp).encode())
+
+
+def get_window_start(
+    path: str, now: float, minutes: int, max_catch_up: float
+) -> float:
+    """Return since when Triggers are due, back to the last processed one.
+
+    Catching up is limited to max_catch_up seconds, a run only covering its
+    regular window of minutes otherwise.
+    """
+    start = now - minutes * 60
+    processed_until = read_processed_until(path) if path else None
+    if processed_until is not None and processed_until < start:
+        start = max(processed_until, now - max_catch_up)
+    return start
+
+
+def read_header(data) -> tuple:
+    """Return (flags, expires_at, one_off_count, time zone) of a schedule."""
+    magic, version, flags, expires_at, one_off_count, time_zone = (
+        HEADER.unpack_from(data)
+    )
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a schedule file of this version")
+    if len(data) < ONE_OFF_OFFSET + one_off_count * FIRE_TIME.size:
+        raise ValueError("Truncated schedule file")
+    return flags, expires_at, one_off_count, time_zone.rstrip(b"\0").decode()
+
+
+def is_expired(path: str, now: float) -> bool:
+    try:
+        with open(path, "rb") as f:
+            _, expires_at, _, _ = read_header(f.read(HEADER.size))
+    except (OSError, ValueError, struct.error):
+        return True
+    return now >= expires_at
+
+
+def has_recurring_trigger(data, first: int, last: int) -> bool:
+    """Return whether any minute from first to last (wrapping) is set."""
+    minute_count = (last - first) % MINUTES_PER_WEEK + 1
+    for offset in range(minute_count):
+        minute = (first + offset) % MINUTES_PER_WEEK
+        if data[BITMAP_OFFSET + minute // 8] >> (minute % 8) & 1:
+            return True
+    return False
+
+
+def has_one_off_trigger(data, count: int, start: int, end: float) -> bool:
+    """Binary search the fire times for one from start to end."""
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        fire_time = FIRE_TIME.unpack_from(
+            data, ONE_OFF_OFFSET + middle * FIRE_TIME.size
+        )[0]
+        if fire_time < start:
+            low = middle + 1
+        else:
+            high = middle
+    if low == count:
+        return False
+    return FIRE_TIME.unpack_from(data, ONE_OFF_OFFSET + low * FIRE_TIME.size)[0] <= end
+
+
+def is_due(path: str, start: float, end: float) -> bool:
+    """Return whether a run for the window from start to end may be needed.
+
+    Boundary minutes of recurring Triggers count as a whole, the run itself
+    checks exact times.
+    """
+    try:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                flags, expires_at, one_off_count, time_zone = read_header(data)
+                if flags & FLAG_NEEDS_SYNC or end >= expires_at:
+                    return True
+                if end - start >= MINUTES_PER_WEEK * 60:
+                    return True
+                zone = ZoneInfo(time_zone)
+                return has_recurring_trigger(
+                    data,
+                    get_minute_of_week(start, zone),
+                    get_minute_of_week(end, zone),
+                ) or has_one_off_trigger(data, one_off_count, int(start), end)
+    except (OSError, ValueError, LookupError, struct.error):
+        return True
@@ -1,14 +1,68 @@
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import fcntl
+import io
 import logging
+import threading
+import time
+import urllib.parse
 
+import pytest
+import requests
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from model_bakery import baker
 
+from fritzbox_thermostat_triggers import launcher
+from fritzbox_thermostat_triggers.triggers.emulator import FritzboxEmulator
+from fritzbox_thermostat_triggers.triggers.fritzbox import SessionFritzhome
+from fritzbox_thermostat_triggers.triggers.fritzbox import get_fritzbox_circuit_breaker
+from fritzbox_thermostat_triggers.triggers.fritzbox import get_fritzbox_connection
+from fritzbox_thermostat_triggers.triggers.fritzbox import parse_thermostat_devices
+from fritzbox_thermostat_triggers.triggers.fritzbox import reset_fritzbox_connections
+from fritzbox_thermostat_triggers.triggers.management.commands.report_trigger_latency import get_latency_percentiles  # noqa
+from fritzbox_thermostat_triggers.triggers.management.commands.run_trigger_scheduler import TriggerScheduler  # noqa
+from fritzbox_thermostat_triggers.triggers.management.commands.sync_and_trigger_thermostats import advance_stale_triggers  # noqa
+from fritzbox_thermostat_triggers.triggers.management.commands.sync_and_trigger_thermostats import get_due_triggers  # noqa
+from fritzbox_thermostat_triggers.triggers.management.commands.sync_and_trigger_thermostats import set_target_temperatures  # noqa
+from fritzbox_thermostat_triggers.triggers.management.commands.sync_and_trigger_thermostats import sync_thermostats  # noqa
+from fritzbox_thermostat_triggers.triggers.metrics import load_metrics
+from fritzbox_thermostat_triggers.triggers.models import PushNotification
 from fritzbox_thermostat_triggers.triggers.models import Thermostat
+from fritzbox_thermostat_triggers.triggers.models import ThermostatLog
+from fritzbox_thermostat_triggers.triggers.models import ThermostatLogRollup
+from fritzbox_thermostat_triggers.triggers.models import Trigger
+from fritzbox_thermostat_triggers.triggers.models import WEEKDAY_FIELD_NAMES
+from fritzbox_thermostat_triggers.triggers.notifications import build_push_notifications
+from fritzbox_thermostat_triggers.triggers.notifications import claim_push_notification
+from fritzbox_thermostat_triggers.triggers.notifications import deliver_push_notifications
+from fritzbox_thermostat_triggers.triggers.schedule import write_schedule_file
+from fritzbox_thermostat_triggers.triggers.schedule_file import is_due
+from fritzbox_thermostat_triggers.triggers.schedule_file import read_processed_until
+from fritzbox_thermostat_triggers.triggers.schedule_file import write_processed_until
+from fritzbox_thermostat_triggers.triggers.views import deliver_push_notifications_in_background  # noqa
 
 logger = logging.getLogger(__name__)
 
 
+@pytest.fixture(autouse=True)
+def state_files_in_tmp_path(settings, tmp_path):
+    settings.FRITZBOX_CIRCUIT_PATH = str(tmp_path / "circuit.json")
+    settings.METRICS_STATE_PATH = str(tmp_path / "metrics.json")
+    settings.METRICS_TEXTFILE_PATH = ""
+    settings.TRIGGER_RUN_LOCK_PATH = str(tmp_path / "run.lock")
+    settings.TRIGGER_SCHEDULE_PATH = ""
+    settings.TRIGGER_PROCESSED_UNTIL_PATH = ""
+    # Circuit breakers are kept per process, like sessions.
+    reset_fritzbox_connections()
+    yield
+    reset_fritzbox_connections()
+
+
 class MockedFritzbox:
     def login(*args, **kwargs):
         pass
@@ -16,9 +70,15 @@ class MockedFritzbox:
     def set_target_temperature(*args, **kwargs):
         pass
 
+    def get_target_temperature(*args, **kwargs):
+        return 21
+
     def get_devices(*args, **kwargs):
         pass
 
+    def get_thermostat_devices(*args, **kwargs):
+        return []
+
 
 class MockedDevice:
     def __init__(self, ain, name, target_temperature):
@@ -28,9 +88,41 @@ class MockedDevice:
         self.has_thermostat = True
 
 
-def mocked_send_push_notification(message, title=None):
-    logger.debug(title)
-    logger.debug(message)
+def mocked_deliver_push_notifications(client=None):
+    return 0
+
+
+COMMAND_MODULE = (
+    "fritzbox_thermostat_triggers.triggers.management.commands."
+    "sync_and_trigger_thermostats"
+)
+
+
+@pytest.fixture
+def use_fritzbox(monkeypatch):
+    """Let the command talk to given mocked Fritzbox, without notifying."""
+
+    def use(fritzbox_class):
+        monkeypatch.setattr(
+            f"{COMMAND_MODULE}.deliver_push_notifications",
+            mocked_deliver_push_notifications,
+        )
+        monkeypatch.setattr(f"{COMMAND_MODULE}.get_fritzbox_connection", fritzbox_class)
+
+    return use
+
+
+@pytest.fixture
+def fritzbox_writes(use_fritzbox):
+    """Return the list of (ain, temperature) the command writes to."""
+    writes = []
+
+    class RecordingFritzbox(MockedFritzbox):
+        def set_target_temperature(self, ain, temperature):
+            writes.append((ain, temperature))
+
+    use_fritzbox(RecordingFritzbox)
+    return writes
 
 
 def test_command_sync_and_trigger_thermostats(db, monkeypatch):
@@ -47,18 +139,17 @@ def test_command_sync_and_trigger_thermostats(db, monkeypatch):
     def mocked_get_fritzbox_connection():
         return MockedFritzbox()
 
+    devices = [device_livingroom, device_kitchen]
+
     def mocked_get_fritzbox_thermostat_devices():
-        return [
-            device_livingroom,
-            device_kitchen,
-        ]
+        return devices
 
     monkeypatch.setattr(
         (
             "fritzbox_thermostat_triggers.triggers.management.commands."
-            "sync_and_trigger_thermostats.send_push_notification"
+            "sync_and_trigger_thermostats.deliver_push_notifications"
         ),
-        mocked_send_push_notification,
+        mocked_deliver_push_notifications,
     )
     monkeypatch.setattr(
         (
@@ -98,8 +189,9 @@ def test_command_sync_and_trigger_thermostats(db, monkeypatch):
     call_command("sync_and_trigger_thermostats")
     call_command("sync_and_trigger_thermostats")
 
-    # A new Device has been created by the sync, the existing one has
-    # its name corrected.
+    # The Thermostat was never synced, so the run executing the Trigger
+    # downloaded the device list along the way. A new Device has been
+    # created by the sync, the existing one has its name corrected.
     assert Thermostat.objects.count() == 2
     thermostat_livingroom.refresh_from_db()
     assert thermostat_livingroom.name == device_livingroom.name
@@ -142,12 +234,1093 @@ def test_command_sync_and_trigger_thermostats(db, monkeypatch):
     assert trigger.enabled
     assert trigger.logs.count() == 1
 
-    # If we remove the logs we can trigger it again though.
-    trigger.logs.all().delete()
-    assert trigger.logs.count() == 0
+    # The last execution is kept on the Trigger itself.
+    assert trigger.last_executed_at == log.created_at
+    assert not trigger.last_executed_no_op
+
+    # If we forget about it we can trigger it again though.
+    trigger.last_executed_at = None
+    trigger.save()
 
     call_command("sync_and_trigger_thermostats")
 
     trigger.refresh_from_db()
     assert trigger.enabled
-    assert trigger.logs.count() == 1
+    assert trigger.logs.count() == 2
+    assert trigger.last_executed_at == trigger.logs.latest("created_at").created_at
+    # Its next occurrence is tomorrow, so it is no longer due.
+    assert trigger.next_fire_at == trigger.time + timedelta(days=1)
+
+    # New devices are only looked for again once the sync interval passed.
+    devices.append(MockedDevice("11962 0785017", "Office", 21))
+    trigger.last_executed_at = None
+    trigger.save()
+    call_command("sync_and_trigger_thermostats")
+    assert Thermostat.objects.count() == 2
+
+    Thermostat.objects.update(
+        target_temperature_read_at=timezone.now() - timedelta(hours=2)
+    )
+    trigger.refresh_from_db()
+    trigger.last_executed_at = None
+    trigger.save()
+    call_command("sync_and_trigger_thermostats")
+    assert Thermostat.objects.count() == 3
+
+
+def test_trigger_get_next_fire_at(db):
+    now = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0)
+    one_off = baker.make("triggers.Trigger", temperature=20, time=now)
+    assert one_off.get_next_fire_at(now - timedelta(minutes=1)) == now
+    assert one_off.get_next_fire_at(now + timedelta(minutes=1)) is None
+
+    # Recurring on the weekday of tomorrow only, date of time is ignored.
+    tomorrow = now + timedelta(days=1)
+    weekday_field = f"recur_on_{tomorrow.strftime('%A').lower()}"
+    recurring = baker.make(
+        "triggers.Trigger",
+        temperature=20,
+        time=now - timedelta(days=30),
+        **{weekday_field: True},
+    )
+    assert recurring.get_next_fire_at(now) == tomorrow
+    assert recurring.get_next_fire_at(tomorrow) == tomorrow
+    assert recurring.get_next_fire_at(
+        tomorrow + timedelta(seconds=1)
+    ) == tomorrow + timedelta(days=7)
+
+
+def test_trigger_scheduler_queue(db):
+    now = timezone.localtime()
+    soon = baker.make(
+        "triggers.Trigger", temperature=20, time=now + timedelta(minutes=5)
+    )
+    later = baker.make(
+        "triggers.Trigger", temperature=20, time=now + timedelta(hours=5)
+    )
+    baker.make(
+        "triggers.Trigger", enabled=False, temperature=20, time=now + timedelta(minutes=1)
+    )
+
+    scheduler = TriggerScheduler()
+    scheduler.reload(after=now)
+    assert [trigger_id for _, trigger_id in scheduler.queue] == [soon.id, later.id]
+    assert scheduler.get_seconds_until_next(now) == pytest.approx(300, abs=1)
+    assert scheduler.pop_due(now) == []
+    assert not scheduler.reload_if_changed(after=now)
+
+    due = scheduler.pop_due(now + timedelta(minutes=6))
+    assert due == [(soon.time, soon.id)]
+
+    later.delete()
+    assert scheduler.reload_if_changed(after=now)
+    assert [trigger_id for _, trigger_id in scheduler.queue] == [soon.id]
+
+
+def test_fritzbox_session_is_reused_across_calls_and_runs(settings, tmp_path, monkeypatch):
+    settings.FRITZBOX_HOST = "fritz.box"
+    settings.FRITZBOX_USER = "user"
+    settings.FRITZBOX_SID_CACHE_PATH = str(tmp_path / "sid.json")
+    valid_sids = set()
+
+    def mocked_login_request(self, username=None, secret=None):
+        if not username:
+            return ("0000000000000000", "1234567z", 0)
+        sid = f"{len(valid_sids) + 1:016d}"
+        valid_sids.add(sid)
+        return (sid, "1234567z", 0)
+
+    def mocked_request(self, url, params=None):
+        if params["sid"] not in valid_sids:
+            response = requests.Response()
+            response.status_code = 403
+            raise requests.HTTPError(response=response)
+        return "1"
+
+    monkeypatch.setattr(SessionFritzhome, "_login_request", mocked_login_request)
+    monkeypatch.setattr(SessionFritzhome, "_request", mocked_request)
+    reset_fritzbox_connections()
+
+    # One login per process, shared by all calls.
+    fritzbox = get_fritzbox_connection()
+    fritzbox.set_target_temperature("11962 0785015", 21)
+    assert get_fritzbox_connection() is fritzbox
+    get_fritzbox_connection().set_target_temperature("11962 0785016", 21)
+    assert fritzbox.login_count == 1
+
+    # A later run reuses the persisted SID without logging in.
+    reset_fritzbox_connections()
+    fritzbox = get_fritzbox_connection()
+    fritzbox.set_target_temperature("11962 0785015", 21)
+    assert fritzbox.login_count == 0
+
+    # Once the box rejects the SID, we log in again and retry.
+    valid_sids.clear()
+    fritzbox.set_target_temperature("11962 0785015", 21)
+    assert fritzbox.login_count == 1
+    reset_fritzbox_connections()
+
+
+def test_trigger_next_fire_at_and_due_query(db):
+    now = timezone.localtime()
+    one_off = baker.make("triggers.Trigger", temperature=20, time=now)
+    assert one_off.next_fire_at == now
+
+    # Disabling with update_fields also clears the next fire time.
+    one_off.enabled = False
+    one_off.save(update_fields=["enabled"])
+    one_off.refresh_from_db()
+    assert one_off.next_fire_at is None
+
+    recurring = baker.make(
+        "triggers.Trigger",
+        temperature=20,
+        time=now - timedelta(days=3, minutes=10),
+        **{field: True for field in WEEKDAY_FIELD_NAMES},
+    )
+    assert recurring.next_fire_at == now + timedelta(days=1, minutes=-10)
+
+    # Pretend the last run happened before today's occurrence.
+    Trigger.objects.filter(id=recurring.id).update(
+        next_fire_at=now - timedelta(minutes=10)
+    )
+    assert get_due_triggers(now - timedelta(minutes=15), now) == [recurring]
+    assert get_due_triggers(now - timedelta(minutes=5), now) == []
+
+    # Once that occurrence has passed the run window, it moves on.
+    assert advance_stale_triggers(now - timedelta(minutes=5)) == 1
+    recurring.refresh_from_db()
+    assert recurring.next_fire_at == now + timedelta(days=1, minutes=-10)
+    assert advance_stale_triggers(now - timedelta(minutes=5)) == 0
+
+
+@pytest.mark.parametrize("device_count", [2, 8])
+def test_command_queries_do_not_grow_with_triggers_and_devices(
+    db, use_fritzbox, django_assert_num_queries, device_count
+):
+    devices = [
+        MockedDevice(f"11962 07850{i:02d}", f"Room {i}", 21)
+        for i in range(device_count)
+    ]
+    now = timezone.localtime()
+    for device in devices:
+        thermostat = baker.make(
+            "triggers.Thermostat",
+            ain=device.ain,
+            name=device.name,
+            target_temperature=21,
+            target_temperature_read_at=now,
+        )
+        baker.make(
+            "triggers.Trigger",
+            thermostat=thermostat,
+            temperature=0,
+            time=now,
+            _quantity=3,
+            **{field: True for field in WEEKDAY_FIELD_NAMES},
+        )
+
+    use_fritzbox(MockedFritzbox)
+
+    # Stale Triggers, due Triggers, whether to sync and Thermostats, then the
+    # savepoint around logs, Triggers and Thermostats written in bulk.
+    with django_assert_num_queries(9):
+        call_command("sync_and_trigger_thermostats", verbose=True)
+
+
+def test_sync_thermostats_in_bulk(db, django_assert_num_queries, caplog):
+    baker.make("triggers.Thermostat", ain="11962 0785001", name="Old name")
+    baker.make("triggers.Thermostat", ain="11962 0785002", name="Kitchen")
+    gone = baker.make("triggers.Thermostat", ain="11962 0785003", name="Garage")
+    devices = [
+        MockedDevice("11962 0785001", "Living Room", 21),
+        MockedDevice("11962 0785002", "Kitchen", 21),
+    ] + [MockedDevice(f"11962 07851{i:02d}", f"Room {i}", 21) for i in range(10)]
+
+    # Loading, inserting and renaming, no matter how many devices.
+    with django_assert_num_queries(3):
+        thermostats_by_ain = sync_thermostats(devices)
+
+    assert Thermostat.objects.count() == 13
+    assert thermostats_by_ain["11962 0785001"].name == "Living Room"
+    assert Thermostat.objects.get(ain="11962 0785001").name == "Living Room"
+    assert all(thermostat.id for thermostat in thermostats_by_ain.values())
+    assert f"Thermostat {gone} is no longer known" in caplog.text
+
+
+def test_command_records_partial_failures(db, use_fritzbox):
+    now = timezone.localtime()
+    thermostat_ok, thermostat_broken = baker.make(
+        "triggers.Thermostat",
+        target_temperature=21,
+        target_temperature_read_at=now,
+        _quantity=2,
+    )
+    trigger_ok = baker.make(
+        "triggers.Trigger", thermostat=thermostat_ok, temperature=0, time=now
+    )
+    trigger_broken = baker.make(
+        "triggers.Trigger", thermostat=thermostat_broken, temperature=0, time=now
+    )
+
+    class PartiallyBrokenFritzbox(MockedFritzbox):
+        def set_target_temperature(self, ain, temperature):
+            if ain == thermostat_broken.ain:
+                raise requests.ConnectionError("DECT timeout")
+
+    use_fritzbox(PartiallyBrokenFritzbox)
+
+    with pytest.raises(CommandError, match="1 Trigger"):
+        call_command("sync_and_trigger_thermostats")
+
+    # The working device has been logged and its Trigger disabled...
+    trigger_ok.refresh_from_db()
+    assert not trigger_ok.enabled
+    assert trigger_ok.logs.count() == 1
+
+    # ...while the failed one can still be picked up again.
+    trigger_broken.refresh_from_db()
+    assert trigger_broken.enabled
+    assert trigger_broken.logs.count() == 0
+
+
+def test_executions_record_their_delay(db, use_fritzbox, django_assert_num_queries):
+    thermostat = baker.make(
+        "triggers.Thermostat", ain="11962 0785015", name="Living Room"
+    )
+    trigger = baker.make(
+        "triggers.Trigger", thermostat=thermostat, temperature=18, time=timezone.now()
+    )
+    scheduled_for = trigger.next_fire_at
+
+    class SlowFritzbox(MockedFritzbox):
+        def set_target_temperature(self, ain, temperature):
+            time.sleep(0.2)
+
+    use_fritzbox(SlowFritzbox)
+    call_command("sync_and_trigger_thermostats")
+
+    # Counted until the device acknowledged, not just until the run started.
+    log = trigger.logs.get()
+    assert log.scheduled_for == scheduled_for
+    assert log.delay_seconds >= 0.2
+    assert log.delay_seconds <= (log.created_at - scheduled_for).total_seconds()
+
+    # Manual executions were not scheduled, so they are no measure.
+    baker.make("triggers.ThermostatLog", thermostat=thermostat, temperature=21)
+    kitchen = baker.make("triggers.Thermostat", name="Kitchen")
+    for delay in range(1, 101):
+        baker.make(
+            "triggers.ThermostatLog",
+            thermostat=kitchen,
+            temperature=21,
+            scheduled_for=timezone.now(),
+            delay_seconds=delay,
+        )
+
+    with django_assert_num_queries(1):
+        rows = get_latency_percentiles()
+    assert [
+        (row["thermostat"], row["count"], row["p50"], row["p95"], row["p99"])
+        for row in rows
+    ] == [
+        ("Kitchen", 100, 50, 95, 99),
+        ("Living Room", 1, log.delay_seconds, log.delay_seconds, log.delay_seconds),
+    ]
+
+    stdout = io.StringIO()
+    call_command("report_trigger_latency", stdout=stdout)
+    assert stdout.getvalue().splitlines()[1].split() == [
+        "Kitchen", "100", "50.0s", "95.0s", "99.0s", "100.0s"
+    ]
+
+
+def test_set_target_temperatures_concurrently(monkeypatch):
+    written = []
+
+    class SlowFritzbox(MockedFritzbox):
+        def set_target_temperature(self, ain, temperature):
+            time.sleep(0.2)
+            if ain == "broken":
+                raise requests.ConnectionError("DECT timeout")
+            written.append((ain, temperature))
+
+    fritzbox = SlowFritzbox()
+    monkeypatch.setattr(
+        (
+            "fritzbox_thermostat_triggers.triggers.management.commands."
+            "sync_and_trigger_thermostats.get_fritzbox_connection"
+        ),
+        lambda: fritzbox,
+    )
+    writes = [("a", 21), ("b", 21), ("broken", 21), ("a", 0), ("c", 21)]
+
+    started_at = time.monotonic()
+    errors = set_target_temperatures(writes, max_concurrency=4)
+    duration = time.monotonic() - started_at
+
+    # Roughly the slowest device ("a" gets two writes), not the sum.
+    assert duration < 0.6
+    assert [error is not None for error in errors] == [
+        False, False, True, False, False
+    ]
+    assert [write for write in written if write[0] == "a"] == [("a", 21), ("a", 0)]
+
+
+class PushoverStandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive.
+
+    def setup(self):
+        super().setup()
+        self.server.connection_count += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.messages.append(urllib.parse.parse_qs(body.decode()))
+        if self.server.drop_next:
+            # Received, but the answer gets lost on the way back.
+            self.server.drop_next -= 1
+            self.close_connection = True
+            return
+        status = 500 if self.server.fail_next else 200
+        self.server.fail_next = max(self.server.fail_next - 1, 0)
+        payload = b'{"status": 1}'
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if self.server.close_idle:
+            # Gone by the next request, without telling the client.
+            self.server.close_idle -= 1
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def pushover_stand_in(settings):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PushoverStandIn)
+    server.connection_count = 0
+    server.messages = []
+    server.fail_next = 0
+    server.drop_next = 0
+    server.close_idle = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    settings.PUSHOVER_USER_KEY = "user-key"
+    settings.PUSHOVER_API_TOKEN = "api-token"
+    settings.PUSHOVER_API_URL = (
+        f"http://127.0.0.1:{server.server_address[1]}/1/messages.json"
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_push_notifications_are_delivered_from_outbox(db, pushover_stand_in):
+    notifications = build_push_notifications(
+        [("Living Room is now off", "Living Room -> off")] * 3
+    )
+    PushNotification.objects.bulk_create(notifications)
+    pushover_stand_in.fail_next = 1
+
+    # One failure is retried later, the rest goes over a single connection.
+    assert deliver_push_notifications() == 2
+    assert pushover_stand_in.connection_count == 1
+    assert pushover_stand_in.messages[0]["token"] == ["api-token"]
+
+    failed = PushNotification.objects.get(sent_at__isnull=True)
+    assert failed.attempts == 1
+    assert failed.next_attempt_at > timezone.now()
+    assert "HTTP 500" in failed.last_error
+    assert deliver_push_notifications() == 0
+
+    PushNotification.objects.update(next_attempt_at=timezone.now())
+    call_command("send_push_notifications")
+    assert not PushNotification.objects.filter(sent_at__isnull=True).exists()
+    assert len(pushover_stand_in.messages) == 4
+
+    # Several changes of a run can be merged into one message.
+    merged = build_push_notifications(
+        [("Kitchen is now off", None), ("Office is now off", None)], merge=True
+    )
+    assert len(merged) == 1
+    assert merged[0].message == "Kitchen is now off\nOffice is now off"
+
+
+def test_push_notifications_are_sent_once(db, pushover_stand_in):
+    PushNotification.objects.bulk_create(
+        build_push_notifications([("Kitchen is now off", None)] * 2)
+    )
+    # Another process delivering at the same time got the first one.
+    taken, pending = PushNotification.objects.order_by("id")
+    assert claim_push_notification(taken)
+    assert not claim_push_notification(taken)
+
+    # Unclear whether Pushover got it, so it is not sent again at all.
+    pushover_stand_in.drop_next = 1
+    assert deliver_push_notifications() == 0
+    assert len(pushover_stand_in.messages) == 1
+    pending.refresh_from_db()
+    assert pending.attempts == 1
+    assert pending.sent_at is not None
+    assert "may have arrived" in pending.last_error
+
+    # A kept-alive connection closed by the server meanwhile is replaced
+    # right away, without waiting for a retry.
+    PushNotification.objects.bulk_create(
+        build_push_notifications([("Office is now off", None)] * 2)
+    )
+    pushover_stand_in.close_idle = 1
+    assert deliver_push_notifications() == 2
+    assert len(pushover_stand_in.messages) == 3
+    assert pushover_stand_in.connection_count == 3
+
+
+def test_push_notifications_are_delivered_in_background(
+    transactional_db, pushover_stand_in
+):
+    PushNotification.objects.bulk_create(
+        build_push_notifications([("Kitchen is now off", None)])
+    )
+    deliver_push_notifications_in_background().join(timeout=10)
+    assert len(pushover_stand_in.messages) == 1
+    assert PushNotification.objects.get().sent_at is not None
+
+
+def test_execute_trigger_view_only_talks_to_its_device(
+    admin_client, monkeypatch, pushover_stand_in, django_capture_on_commit_callbacks
+):
+    requests_sent = []
+    deliveries_started = []
+
+    class SingleDeviceFritzbox(MockedFritzbox):
+        def get_thermostat_devices(self):
+            raise AssertionError("Should not download the whole device list")
+
+        def get_target_temperature(self, ain):
+            requests_sent.append(("get", ain))
+            return 21
+
+        def set_target_temperature(self, ain, temperature):
+            requests_sent.append(("set", ain))
+
+    monkeypatch.setattr(
+        (
+            "fritzbox_thermostat_triggers.triggers.management.commands."
+            "sync_and_trigger_thermostats.get_fritzbox_connection"
+        ),
+        SingleDeviceFritzbox,
+    )
+    monkeypatch.setattr(
+        "fritzbox_thermostat_triggers.triggers.views."
+        "deliver_push_notifications_in_background",
+        lambda: deliveries_started.append(True),
+    )
+    thermostat = baker.make("triggers.Thermostat", ain="11962 0785015")
+    trigger = baker.make(
+        "triggers.Trigger", thermostat=thermostat, temperature=0, time=timezone.now()
+    )
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = admin_client.post(f"/trigger/{trigger.id}/execute")
+    assert response.status_code == 302
+    assert requests_sent == [("get", thermostat.ain), ("set", thermostat.ain)]
+    assert trigger.logs.get().no_op is False
+    # Notified right away, not only by the next run with due Triggers, but
+    # without the response waiting on Pushover.
+    assert deliveries_started == [True]
+    assert pushover_stand_in.messages == []
+    assert PushNotification.objects.get().sent_at is None
+
+    # Temperature is already set, so there is nothing to send.
+    trigger.temperature = 21
+    trigger.save()
+    admin_client.post(f"/trigger/{trigger.id}/execute")
+    assert requests_sent[2:] == [("get", thermostat.ain)]
+    assert trigger.logs.filter(no_op=True).count() == 1
+
+
+def test_list_triggers_queries_do_not_grow_with_triggers(admin_client):
+    def count_queries():
+        with CaptureQueriesContext(connection) as context:
+            response = admin_client.get("/triggers/")
+        assert response.status_code == 200
+        return len(context.captured_queries), response
+
+    def make_triggers(count):
+        for _ in range(count):
+            thermostat = baker.make("triggers.Thermostat", name="Living Room")
+            one_off = baker.make(
+                "triggers.Trigger",
+                thermostat=thermostat,
+                temperature=20,
+                time=timezone.now(),
+                last_executed_at=timezone.now(),
+            )
+            baker.make("triggers.ThermostatLog", thermostat=thermostat, trigger=one_off)
+            baker.make(
+                "triggers.Trigger",
+                thermostat=thermostat,
+                temperature=20,
+                time=timezone.now(),
+                recur_on_monday=True,
+            )
+
+    make_triggers(2)
+    query_count, response = count_queries()
+    assert len(response.context["onetime_triggers"]) == 2
+    assert len(response.context["recurring_triggers"]) == 2
+    # The last execution is shown from the Triggers themselves.
+    assert response.content.decode().count('title="Last triggered"') == 2
+
+    make_triggers(20)
+    assert count_queries()[0] == query_count
+
+
+def test_list_logs_keyset_pagination(admin_client, django_assert_max_num_queries):
+    kitchen = baker.make("triggers.Thermostat", name="Kitchen")
+    office = baker.make("triggers.Thermostat", name="Office")
+    trigger = baker.make("triggers.Trigger", thermostat=kitchen, time=timezone.now())
+    baker.make(
+        "triggers.ThermostatLog", thermostat=kitchen, trigger=trigger, _quantity=70
+    )
+    baker.make("triggers.ThermostatLog", thermostat=office, no_op=True, _quantity=10)
+
+    response = admin_client.get("/logs/")
+    first_page = response.context["logs"]
+    assert len(first_page) == 50
+    assert response.context["next_url"]
+
+    # Older logs are loaded by htmx as a partial, continuing seamlessly.
+    seen_ids = {log.id for log in first_page}
+    with django_assert_max_num_queries(4):
+        response = admin_client.get(response.context["next_url"], HTTP_HX_REQUEST="true")
+    assert response.templates[0].name == "triggers/_log_rows.html"
+    second_page = response.context["logs"]
+    assert len(second_page) == 30
+    assert not response.context["next_url"]
+    assert seen_ids.isdisjoint(log.id for log in second_page)
+    assert first_page[-1].created_at >= second_page[0].created_at
+
+    response = admin_client.get(f"/logs/?thermostat={office.id}")
+    assert len(response.context["logs"]) == 10
+    response = admin_client.get(f"/logs/?trigger={trigger.id}&no_op=0")
+    assert len(response.context["logs"]) == 50
+    assert "trigger=" in response.context["next_url"]
+    assert admin_client.get("/logs/?before=nonsense").status_code == 400
+
+
+@pytest.mark.django_db(transaction=True)  # VACUUM needs to run outside one.
+def test_compact_thermostat_logs(admin_client, settings):
+    settings.TIME_ZONE = "Europe/Berlin"
+    kitchen = baker.make("triggers.Thermostat", name="Kitchen")
+    office = baker.make("triggers.Thermostat", name="Office")
+    now = timezone.now()
+    old = now - timedelta(days=settings.THERMOSTAT_LOG_RETENTION_DAYS + 3)
+
+    def make_log(thermostat, created_at, temperature, no_op=False):
+        log = baker.make(
+            "triggers.ThermostatLog",
+            thermostat=thermostat,
+            temperature=temperature,
+            no_op=no_op,
+        )
+        ThermostatLog.objects.filter(id=log.id).update(created_at=created_at)
+
+    for minutes in range(7):
+        make_log(kitchen, old + timedelta(minutes=minutes), 18 + minutes, no_op=minutes < 2)
+    make_log(office, old - timedelta(days=1), 21)
+    make_log(kitchen, now, 22)
+
+    # Small chunks make a day span several transactions, which must merge.
+    call_command("compact_thermostat_logs", chunk_size=3, vacuum=True)
+
+    assert ThermostatLog.objects.count() == 1
+    rollups = ThermostatLogRollup.objects.order_by("date")
+    assert [(r.thermostat, r.count, r.no_op_count) for r in rollups] == [
+        (office, 1, 0),
+        (kitchen, 7, 2),
+    ]
+    assert rollups[1].last_temperature == 24
+    assert rollups[1].date == timezone.localtime(old).date()
+
+    # Running again has nothing left to do.
+    call_command("compact_thermostat_logs")
+    assert ThermostatLogRollup.objects.get(thermostat=kitchen).count == 7
+
+    # The logs page carries on with the rollups once the logs run out.
+    response = admin_client.get("/logs/")
+    assert len(response.context["logs"]) == 1
+    assert response.context["rollups"] == list(rollups.reverse())
+    response = admin_client.get(f"/logs/?thermostat={office.id}")
+    assert response.context["rollups"] == [rollups[0]]
+    response = admin_client.get("/logs/?no_op=1")
+    assert response.context["rollups"] == [rollups[1]]
+
+
+def test_command_serves_target_temperatures_from_cache(db, use_fritzbox, settings):
+    settings.FRITZBOX_DEVICE_CACHE_TTL_SECONDS = 600
+    requests_sent = []
+
+    class CountingFritzbox(MockedFritzbox):
+        def get_thermostat_devices(self):
+            raise AssertionError("Should not download the whole device list")
+
+        def get_target_temperature(self, ain):
+            requests_sent.append(("get", ain))
+            return 21
+
+        def set_target_temperature(self, ain, temperature):
+            requests_sent.append(("set", ain))
+
+    use_fritzbox(CountingFritzbox)
+
+    now = timezone.now()
+    fresh = baker.make(
+        "triggers.Thermostat",
+        ain="11962 0785001",
+        target_temperature=21,
+        target_temperature_read_at=now - timedelta(minutes=5),
+    )
+    stale = baker.make(
+        "triggers.Thermostat",
+        ain="11962 0785002",
+        target_temperature=18,
+        target_temperature_read_at=now - timedelta(minutes=15),
+    )
+    baker.make("triggers.Trigger", thermostat=fresh, temperature=21, time=now)
+    baker.make("triggers.Trigger", thermostat=stale, temperature=21, time=now)
+
+    call_command("sync_and_trigger_thermostats")
+
+    # The fresh one is known to be set already, the stale one is confirmed
+    # with a read of its own, which turns out it is set already as well.
+    assert requests_sent == [("get", stale.ain)]
+    assert ThermostatLog.objects.filter(no_op=True).count() == 2
+    stale.refresh_from_db()
+    assert stale.target_temperature == 21
+    assert stale.target_temperature_read_at >= now
+
+    # Writing a temperature keeps the cache up to date as well, so later
+    # Triggers don't need to ask again.
+    baker.make("triggers.Trigger", thermostat=stale, temperature=0, time=now)
+    call_command("sync_and_trigger_thermostats")
+    baker.make("triggers.Trigger", thermostat=stale, temperature=0, time=now)
+    call_command("sync_and_trigger_thermostats")
+    assert requests_sent[1:] == [("set", stale.ain)]
+    stale.refresh_from_db()
+    assert stale.target_temperature == 0
+
+
+def test_parse_thermostat_devices():
+    plain = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<devicelist version="1" fwversion="7.57">'
+        '<device identifier="11959 0171328" functionbitmask="320">'
+        "<present>1</present><name>Living Room</name>"
+        "<hkr><tsoll>42</tsoll><absenk>32</absenk></hkr></device>"
+        '<device identifier="08761 0000434" functionbitmask="35712">'
+        "<present>1</present><name>Plug</name><switch><state>1</state></switch>"
+        "</device>"
+        '<device identifier="11959 0171329" functionbitmask="320">'
+        "<present>0</present><name>Garage</name><hkr><tsoll></tsoll></hkr></device>"
+        '<group identifier="grp303E4F-3F7D591A0" functionbitmask="4160">'
+        "<present>1</present><name>Upstairs</name><hkr><tsoll>253</tsoll></hkr>"
+        "<groupinfo><members>16,18</members></groupinfo></group>"
+        "</devicelist>"
+    )
+
+    # Chunks may end anywhere, even within a tag or a character.
+    content = plain.replace("Garage", "Garage für Rad").encode()
+    devices = parse_thermostat_devices(
+        content[start : start + 7] for start in range(0, len(content), 7)
+    )
+
+    assert [
+        (device.ain, device.name, device.present, device.target_temperature)
+        for device in devices
+    ] == [
+        ("11959 0171328", "Living Room", True, 21.0),
+        ("11959 0171329", "Garage für Rad", False, None),
+        ("grp303E4F-3F7D591A0", "Upstairs", True, 126.5),
+    ]
+    assert all(device.has_thermostat for device in devices)
+
+
+@pytest.fixture
+def fritzbox_emulator(settings, tmp_path):
+    emulator = FritzboxEmulator(thermostat_count=3, other_device_count=2, group_count=1)
+    server = emulator.make_server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    settings.FRITZBOX_HOST = f"http://{host}:{port}"
+    settings.FRITZBOX_USER = emulator.user
+    settings.FRITZBOX_PASSWORD = emulator.password
+    settings.FRITZBOX_SID_CACHE_PATH = str(tmp_path / "sid.json")
+    reset_fritzbox_connections()
+    yield emulator
+    reset_fritzbox_connections()
+    server.shutdown()
+    server.server_close()
+
+
+def test_command_and_views_against_fritzbox_emulator(
+    admin_client, fritzbox_emulator, monkeypatch
+):
+    monkeypatch.setattr(
+        (
+            "fritzbox_thermostat_triggers.triggers.management.commands."
+            "sync_and_trigger_thermostats.deliver_push_notifications"
+        ),
+        mocked_deliver_push_notifications,
+    )
+    call_command("sync_and_trigger_thermostats", sync_only=True)
+    thermostats = list(Thermostat.objects.order_by("id"))
+    assert [thermostat.name for thermostat in thermostats] == [
+        "Thermostat 0",
+        "Thermostat 1",
+        "Thermostat 2",
+        "Group 0",
+    ]
+    assert thermostats[0].target_temperature == 21
+
+    # Going through login, the device list and setting a temperature.
+    now = timezone.now()
+    baker.make("triggers.Trigger", thermostat=thermostats[0], temperature=18, time=now)
+    call_command("sync_and_trigger_thermostats")
+    assert fritzbox_emulator.get_target_temperature(thermostats[0].ain) == 18
+    assert fritzbox_emulator.login_count == 1
+
+    # An expired session is replaced on the fly.
+    fritzbox_emulator.expire_sessions()
+    baker.make("triggers.Trigger", thermostat=thermostats[1], temperature=0, time=now)
+    call_command("sync_and_trigger_thermostats")
+    assert fritzbox_emulator.get_target_temperature(thermostats[1].ain) == 126.5
+    assert fritzbox_emulator.login_count == 2
+
+    # Failures of the box are reported, without losing the Trigger.
+    fritzbox_emulator.failing_ains.add(thermostats[2].ain)
+    failing = baker.make(
+        "triggers.Trigger", thermostat=thermostats[2], temperature=18, time=now
+    )
+    with pytest.raises(CommandError, match="1 Trigger"):
+        call_command("sync_and_trigger_thermostats")
+    failing.refresh_from_db()
+    assert failing.enabled
+
+    # Executing from the UI reads and writes just the one device.
+    trigger = baker.make(
+        "triggers.Trigger", thermostat=thermostats[3], temperature=23, time=now
+    )
+    admin_client.post(f"/trigger/{trigger.id}/execute")
+    assert fritzbox_emulator.get_target_temperature(thermostats[3].ain) == 23
+    assert fritzbox_emulator.request_counts["getdevicelistinfos"] == 1
+
+
+def test_command_records_metrics(db, client, fritzbox_emulator, settings, tmp_path):
+    settings.METRICS_TEXTFILE_PATH = str(tmp_path / "triggers.prom")
+    now = timezone.now()
+    # Synced recently, but its target temperature needs to be read again.
+    thermostat = baker.make(
+        "triggers.Thermostat",
+        ain="11959 0000000",
+        target_temperature_read_at=now - timedelta(minutes=20),
+    )
+    baker.make("triggers.Trigger", thermostat=thermostat, temperature=18, time=now)
+    baker.make("triggers.Trigger", thermostat=thermostat, temperature=18, time=now)
+    call_command("sync_and_trigger_thermostats")
+    # Nothing due anymore, which is recorded as a run just as well.
+    call_command("sync_and_trigger_thermostats")
+
+    # Not public, Prometheus scrapes with a bearer token instead of logging in.
+    assert client.get("/metrics").status_code == 401
+    settings.METRICS_BEARER_TOKEN = "scrape-token"
+    assert (
+        client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong-token").status_code
+        == 401
+    )
+    response = client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-token")
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain")
+    text = response.content.decode()
+    assert text == (tmp_path / "triggers.prom").read_text()
+
+    lines = text.splitlines()
+    assert "# TYPE thermostat_triggers_phase_duration_seconds histogram" in lines
+    assert 'thermostat_triggers_phase_duration_seconds_count{phase="total"} 2' in lines
+    assert (
+        'thermostat_triggers_phase_duration_seconds_count{phase="commit"} 1' in lines
+    )
+    # Logged in and read once, written once: the second Trigger was suppressed.
+    assert (
+        "thermostat_triggers_phase_fritzbox_requests_sum"
+        '{phase="read_target_temperatures"} 2' in lines
+    )
+    assert 'thermostat_triggers_executions_total{result="write"} 1' in lines
+    assert 'thermostat_triggers_executions_total{result="suppressed"} 1' in lines
+    assert 'thermostat_triggers_fritzbox_requests_total{command="sethkrtsoll"} 1' in (
+        lines
+    )
+    assert "thermostat_triggers_runs_total 2" in lines
+    assert (
+        'thermostat_triggers_phase_queries_bucket{phase="commit",le="+Inf"} 1' in lines
+    )
+
+    settings.METRICS_STATE_PATH = ""
+    assert (
+        client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-token").status_code
+        == 404
+    )
+
+
+def test_launcher_only_boots_django_when_triggers_are_due(
+    db, settings, tmp_path, monkeypatch, django_capture_on_commit_callbacks
+):
+    path = str(tmp_path / "schedule.bin")
+    settings.TRIGGER_SCHEDULE_PATH = path
+    # Look ahead further than the file would be trusted otherwise.
+    settings.TRIGGER_SCHEDULE_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+    monkeypatch.setenv("TRIGGER_SCHEDULE_PATH", path)
+    processed_until_path = str(tmp_path / "processed_until")
+    monkeypatch.setenv("TRIGGER_PROCESSED_UNTIL_PATH", processed_until_path)
+    booted = []
+    monkeypatch.setattr(
+        "django.core.management.execute_from_command_line", booted.append
+    )
+
+    # Without the file, it is better to run than to miss a Trigger.
+    assert launcher.main(["--minutes", "1"]) == 0
+    assert booted == [["manage.py", "sync_and_trigger_thermostats", "--minutes", "1"]]
+
+    thermostat = baker.make("triggers.Thermostat")
+    now = timezone.now()
+    with django_capture_on_commit_callbacks(execute=True):
+        recurring = baker.make(
+            "triggers.Trigger",
+            thermostat=thermostat,
+            time=now + timedelta(hours=2),
+            **{field: True for field in WEEKDAY_FIELD_NAMES},
+        )
+        one_off = baker.make(
+            "triggers.Trigger", thermostat=thermostat, time=now + timedelta(hours=5)
+        )
+
+    def is_due_at(value, minutes: int = 1) -> bool:
+        timestamp = value.timestamp()
+        return is_due(path, start=timestamp - minutes * 60, end=timestamp)
+
+    booted.clear()
+    assert launcher.main([]) == 0
+    assert booted == []
+    # Nothing was due, so a run after a downtime needn't look back further.
+    assert read_processed_until(processed_until_path) >= now.timestamp()
+    assert not is_due_at(now)
+    assert is_due_at(recurring.next_fire_at)
+    assert is_due_at(recurring.next_fire_at + timedelta(days=1))
+    assert not is_due_at(recurring.next_fire_at - timedelta(minutes=5))
+    assert is_due_at(one_off.next_fire_at)
+    assert not is_due_at(one_off.next_fire_at + timedelta(minutes=2))
+    assert is_due_at(one_off.next_fire_at + timedelta(minutes=2), minutes=5)
+    assert launcher.main(["--sync-only"]) == 0
+    assert len(booted) == 1
+
+    fire_times = (recurring.next_fire_at, one_off.next_fire_at)
+    with django_capture_on_commit_callbacks(execute=True):
+        recurring.delete()
+        one_off.enabled = False
+        one_off.save()
+    assert not any(is_due_at(fire_time) for fire_time in fire_times)
+
+    # Runs are needed until Thermostats are known, or the file is stale.
+    thermostat.delete()
+    write_schedule_file()
+    assert is_due_at(now)
+    baker.make("triggers.Thermostat")
+    settings.TRIGGER_SCHEDULE_MAX_AGE_SECONDS = 0
+    write_schedule_file()
+    # Checked after writing, as the file expires in whole seconds.
+    assert is_due_at(timezone.now())
+    (tmp_path / "schedule.bin").write_bytes(b"garbage")
+    assert is_due_at(now)
+
+
+def test_runs_back_off_from_an_unreachable_fritzbox(
+    db, fritzbox_emulator, settings, caplog, monkeypatch
+):
+    monkeypatch.setattr(
+        (
+            "fritzbox_thermostat_triggers.triggers.management.commands."
+            "sync_and_trigger_thermostats.deliver_push_notifications"
+        ),
+        mocked_deliver_push_notifications,
+    )
+    settings.FRITZBOX_READ_TIMEOUT_SECONDS = 0.2
+    settings.FRITZBOX_CIRCUIT_FAILURE_THRESHOLD = 2
+    settings.FRITZBOX_CIRCUIT_COOLDOWN_SECONDS = 60
+    call_command("sync_and_trigger_thermostats", sync_only=True)
+    thermostats = list(Thermostat.objects.order_by("id"))
+    now = timezone.now()
+
+    # Too slow to answer: each write gives up after the read timeout.
+    fritzbox_emulator.latency = 1
+    slow = [
+        baker.make("triggers.Trigger", thermostat=thermostat, temperature=18, time=now)
+        for thermostat in thermostats[:2]
+    ]
+    started_at = time.monotonic()
+    with pytest.raises(CommandError, match="2 Trigger"):
+        call_command("sync_and_trigger_thermostats")
+    assert time.monotonic() - started_at < 0.9
+    assert all(Trigger.objects.get(id=trigger.id).enabled for trigger in slow)
+
+    # The next run leaves the box alone, but tells which Triggers it skipped.
+    fritzbox_emulator.latency = 0
+    reset_fritzbox_connections()
+    request_count = fritzbox_emulator.request_counts.total()
+    skipped = baker.make(
+        "triggers.Trigger", thermostat=thermostats[2], temperature=18, time=now
+    )
+    with pytest.raises(CommandError, match="3 Trigger\\(s\\) skipped"):
+        call_command("sync_and_trigger_thermostats")
+    assert fritzbox_emulator.request_counts.total() == request_count
+    skipped.refresh_from_db()
+    assert f"Skipped {skipped}: Fritzbox unreachable" in caplog.text
+    with pytest.raises(CommandError, match="skipping the sync"):
+        call_command("sync_and_trigger_thermostats", sync_only=True)
+
+    # Once cooled off, the box is given another chance and recovers.
+    settings.FRITZBOX_CIRCUIT_COOLDOWN_SECONDS = 0
+    reset_fritzbox_connections()
+    call_command("sync_and_trigger_thermostats")
+    assert all(
+        fritzbox_emulator.get_target_temperature(thermostat.ain) == 18
+        for thermostat in thermostats[:3]
+    )
+    settings.FRITZBOX_CIRCUIT_COOLDOWN_SECONDS = 60
+    reset_fritzbox_connections()
+    assert not get_fritzbox_circuit_breaker().is_open()
+
+
+def test_overlapping_runs_are_skipped(db, settings, caplog, monkeypatch):
+    monkeypatch.setattr(
+        f"{COMMAND_MODULE}.get_fritzbox_thermostat_devices",
+        lambda: pytest.fail("Overlapping run talked to the Fritzbox"),
+    )
+    with open(settings.TRIGGER_RUN_LOCK_PATH, "w") as lock_file:
+        # As if another run held the lock.
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        call_command("sync_and_trigger_thermostats", sync_only=True)
+    assert "Previous run still in progress" in caplog.text
+
+    monkeypatch.setattr(f"{COMMAND_MODULE}.get_fritzbox_thermostat_devices", lambda: [])
+    call_command("sync_and_trigger_thermostats", sync_only=True)
+
+
+def test_runs_catch_up_on_triggers_missed_while_down(
+    db, settings, tmp_path, fritzbox_writes
+):
+    settings.TRIGGER_PROCESSED_UNTIL_PATH = str(tmp_path / "processed_until")
+
+    now = timezone.localtime()
+    write_processed_until(
+        settings.TRIGGER_PROCESSED_UNTIL_PATH, (now - timedelta(hours=3)).timestamp()
+    )
+    office, kitchen, hallway = baker.make("triggers.Thermostat", _quantity=3)
+    superseded = [
+        baker.make(
+            "triggers.Trigger",
+            thermostat=office,
+            temperature=16,
+            time=now - timedelta(hours=2),
+        ),
+        baker.make(
+            "triggers.Trigger",
+            thermostat=kitchen,
+            temperature=16,
+            time=now - timedelta(minutes=30),
+        ),
+    ]
+    latest = baker.make(
+        "triggers.Trigger",
+        thermostat=office,
+        temperature=19,
+        time=now - timedelta(hours=1),
+        **{field: True for field in WEEKDAY_FIELD_NAMES},
+    )
+    # As scheduled before the downtime.
+    Trigger.objects.filter(id=latest.id).update(next_fire_at=latest.time)
+    current = baker.make(
+        "triggers.Trigger", thermostat=kitchen, temperature=0, time=now
+    )
+    too_old = baker.make(
+        "triggers.Trigger",
+        thermostat=hallway,
+        temperature=16,
+        time=now - timedelta(hours=5),
+    )
+
+    call_command("sync_and_trigger_thermostats")
+
+    # Only the latest target per Thermostat is applied, a single write each.
+    assert sorted(fritzbox_writes) == sorted([(office.ain, 19), (kitchen.ain, 0)])
+    assert not too_old.logs.exists()
+    assert all(trigger.logs.get().suppressed for trigger in superseded)
+    assert not Trigger.objects.filter(id__in=[t.id for t in superseded], enabled=True)
+    log = latest.logs.get()
+    assert log.scheduled_for == latest.time
+    assert log.delay_seconds >= 60 * 60
+    assert current.logs.exists()
+    counters = load_metrics().counters["executions_total"]
+    assert counters['result="suppressed"'] == 2
+
+    # The next run only looks at the last minute again.
+    processed_until = read_processed_until(settings.TRIGGER_PROCESSED_UNTIL_PATH)
+    assert processed_until >= now.timestamp()
+    fritzbox_writes.clear()
+    call_command("sync_and_trigger_thermostats")
+    assert fritzbox_writes == []
+
+
+def test_conflicting_triggers_are_collapsed_to_one_write(admin_client, fritzbox_writes):
+    now = timezone.localtime()
+    thermostat = baker.make("triggers.Thermostat")
+    override = baker.make(
+        "triggers.Trigger",
+        thermostat=thermostat,
+        temperature=16,
+        time=now - timedelta(seconds=30),
+    )
+    later_override = baker.make(
+        "triggers.Trigger", thermostat=thermostat, temperature=0, time=now
+    )
+    weekly = baker.make(
+        "triggers.Trigger",
+        thermostat=thermostat,
+        temperature=19,
+        time=now,
+        **{field: True for field in WEEKDAY_FIELD_NAMES},
+    )
+
+    call_command("sync_and_trigger_thermostats", minutes=5)
+
+    # One-off beats recurring, later beats earlier.
+    assert fritzbox_writes == [(thermostat.ain, 0)]
+    assert not later_override.logs.get().suppressed
+    for trigger in (override, weekly):
+        trigger.refresh_from_db()
+        assert trigger.logs.get().suppressed
+        assert trigger.last_executed_at is not None
+    assert not override.enabled
+    thermostat.refresh_from_db()
+    assert thermostat.target_temperature == 0
+
+    # Suppressed ones stay suppressed, also for runs covering the window again.
+    call_command("sync_and_trigger_thermostats", minutes=5)
+    assert fritzbox_writes == [(thermostat.ain, 0)]
+    assert weekly.logs.count() == 1
+
+    response = admin_client.get("/logs/?no_op=1")
+    assert {log.trigger for log in response.context["logs"]} == {override, weekly}
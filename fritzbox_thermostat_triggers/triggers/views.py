@@ -1,16 +1,41 @@
+from datetime import date
+from datetime import datetime
 from datetime import timedelta
 from typing import Optional
+from urllib.parse import urlencode
+import hmac
+import logging
+import threading
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.db import connection
+from django.db import transaction
+from django.db.models import BooleanField
+from django.db.models import ExpressionWrapper
+from django.db.models import F
+from django.db.models import Q
+from django.http import Http404
 from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
 from django.shortcuts import redirect
 from django.shortcuts import render
 from django.urls import reverse
 from django.utils import timezone
 from django.views.decorators.http import require_http_methods
 
+from fritzbox_thermostat_triggers.triggers.metrics import get_state_path
+from fritzbox_thermostat_triggers.triggers.metrics import load_metrics
+from fritzbox_thermostat_triggers.triggers.models import Thermostat
 from fritzbox_thermostat_triggers.triggers.models import Trigger
 from fritzbox_thermostat_triggers.triggers.models import ThermostatLog
+from fritzbox_thermostat_triggers.triggers.models import ThermostatLogRollup
+from fritzbox_thermostat_triggers.triggers.models import query_any_recur_on
+from fritzbox_thermostat_triggers.triggers.notifications import deliver_push_notifications
+
+logger = logging.getLogger(__name__)
+
+LOGS_PAGE_SIZE = 50
 
 
 @login_required
@@ -19,16 +44,28 @@ def list_triggers(request):
     alert : str = ""
     executed_trigger_id: Optional[str] = request.GET.get("executed", None)
     if executed_trigger_id:
-        executed_trigger = Trigger.objects.get(id=executed_trigger_id)
+        executed_trigger = Trigger.objects.select_related("thermostat").get(
+            id=executed_trigger_id
+        )
         alert = f"Executed trigger: {executed_trigger}"
 
     theme: str = request.session.get("theme", "light") # Or 'dark'.
     once_expanded: bool = request.session.get("once:expanded", True)
     weekly_expanded: bool = request.session.get("weekly:expanded", True)
 
-    triggers = Trigger.objects.order_by("thermostat__name", "time")
-    onetime_triggers = [trigger for trigger in triggers if not trigger.recurring]
-    recurring_triggers = [trigger for trigger in triggers if trigger.recurring]
+    # Let the database do the work, so rendering needs the same number of
+    # queries no matter how many Triggers there are.
+    triggers = (
+        Trigger.objects.select_related("thermostat")
+        .annotate(
+            is_recurring=ExpressionWrapper(
+                query_any_recur_on, output_field=BooleanField()
+            ),
+        )
+        .order_by("thermostat__name", "time")
+    )
+    onetime_triggers = triggers.filter(is_recurring=False)
+    recurring_triggers = triggers.filter(is_recurring=True)
 
     return render(
         request,
@@ -44,17 +81,114 @@ def list_triggers(request):
     )
 
 
+def encode_log_cursor(log: ThermostatLog) -> str:
+    return f"{log.created_at.isoformat()}_{log.id}"
+
+
+def decode_log_cursor(cursor: str) -> tuple:
+    created_at, log_id = cursor.rsplit("_", 1)
+    return datetime.fromisoformat(created_at), int(log_id)
+
+
+def encode_rollup_cursor(rollup: ThermostatLogRollup) -> str:
+    return f"{rollup.date.isoformat()}_{rollup.id}"
+
+
+def decode_rollup_cursor(cursor: str) -> tuple:
+    day, rollup_id = cursor.rsplit("_", 1)
+    return date.fromisoformat(day), int(rollup_id)
+
+
 @login_required
 @require_http_methods(("GET",))
 def list_logs(request):
     theme : str = request.session.get("theme", "light") # Or 'dark'.
-    logs = ThermostatLog.objects.order_by("-created_at")[:300]
+
+    filters = {
+        key: request.GET[key]
+        for key in ("thermostat", "trigger", "no_op")
+        if request.GET.get(key, "") != ""
+    }
+    logs = ThermostatLog.objects.select_related("thermostat", "trigger").order_by(
+        "-created_at", "-id"
+    )
+    try:
+        if "thermostat" in filters:
+            logs = logs.filter(thermostat_id=int(filters["thermostat"]))
+        if "trigger" in filters:
+            logs = logs.filter(trigger_id=int(filters["trigger"]))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid filter")
+    # Suppressed executions didn't have an effect either.
+    if filters.get("no_op") == "1":
+        logs = logs.filter(Q(no_op=True) | Q(suppressed=True))
+    elif "no_op" in filters:
+        logs = logs.filter(no_op=False, suppressed=False)
+
+    # Keyset pagination: Continue right after the last log shown, which
+    # stays cheap on the (created_at, id) index no matter how deep we go.
+    cursor: Optional[str] = request.GET.get("before", None)
+    rollup_cursor: Optional[str] = request.GET.get("before_day", None)
+    page: list = []
+    next_url: str = ""
+    if not rollup_cursor:
+        if cursor:
+            try:
+                created_at, log_id = decode_log_cursor(cursor)
+            except ValueError:
+                return HttpResponseBadRequest("Invalid cursor")
+            logs = logs.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=log_id)
+            )
+        page = list(logs[: LOGS_PAGE_SIZE + 1])
+        if len(page) > LOGS_PAGE_SIZE:
+            page = page[:LOGS_PAGE_SIZE]
+            query = urlencode({**filters, "before": encode_log_cursor(page[-1])})
+            next_url = reverse("list-logs") + f"?{query}"
+
+    # Compacted periods only remain as daily rollups per Thermostat, carry
+    # on with those once the logs run out. They don't know their Triggers.
+    rollup_page: list = []
+    if not next_url and "trigger" not in filters:
+        rollups = ThermostatLogRollup.objects.select_related("thermostat").order_by(
+            "-date", "-id"
+        )
+        if "thermostat" in filters:
+            rollups = rollups.filter(thermostat_id=int(filters["thermostat"]))
+        if filters.get("no_op") == "1":
+            rollups = rollups.filter(no_op_count__gt=0)
+        elif filters.get("no_op") == "0":
+            rollups = rollups.filter(count__gt=F("no_op_count"))
+        if rollup_cursor:
+            try:
+                day, rollup_id = decode_rollup_cursor(rollup_cursor)
+            except ValueError:
+                return HttpResponseBadRequest("Invalid cursor")
+            rollups = rollups.filter(Q(date__lt=day) | Q(date=day, id__lt=rollup_id))
+        rollup_page = list(rollups[: LOGS_PAGE_SIZE + 1])
+        if len(rollup_page) > LOGS_PAGE_SIZE:
+            rollup_page = rollup_page[:LOGS_PAGE_SIZE]
+            query = urlencode(
+                {**filters, "before_day": encode_rollup_cursor(rollup_page[-1])}
+            )
+            next_url = reverse("list-logs") + f"?{query}"
+
+    context = {
+        "logs": page,
+        "next_url": next_url,
+        "rollups": rollup_page,
+    }
+    if request.htmx:
+        return render(request, "triggers/_log_rows.html", context)
+
     return render(
         request,
         "triggers/logs.html",
         {
+            **context,
+            "filters": filters,
             "theme": theme,
-            "logs": logs,
+            "thermostats": Thermostat.objects.order_by("name"),
         },
     )
 
@@ -128,7 +262,7 @@ def toggle_trigger(request, pk: int):
 
         trigger.time = new_time
 
-    trigger.save(update_fields=["enabled", "time"])
+    trigger.save(update_fields=["enabled", "time", "updated_at"])
 
     return render(
         request,
@@ -151,11 +285,30 @@ def clone_trigger(request, pk: int):
     return redirect(request.META.get("HTTP_REFERER", "list-triggers"))
 
 
+def deliver_push_notifications_quietly():
+    try:
+        deliver_push_notifications()
+    except Exception:
+        logger.exception("Failed to deliver push notifications")
+    finally:
+        # Runs in its own thread, which would leak its database connection.
+        connection.close()
+
+
+def deliver_push_notifications_in_background() -> threading.Thread:
+    """Deliver the outbox without keeping the request waiting on Pushover."""
+    thread = threading.Thread(target=deliver_push_notifications_quietly, daemon=True)
+    thread.start()
+    return thread
+
+
 @login_required
 @require_http_methods(("POST",))
 def execute_trigger(request, pk: int):
-    trigger = Trigger.objects.get(id=pk)
+    trigger = Trigger.objects.select_related("thermostat").get(id=pk)
     trigger.execute()
+    # Unlike runs, nothing else would deliver the notification soon.
+    transaction.on_commit(deliver_push_notifications_in_background)
 
     url: str = reverse("list-triggers") + f"?executed={pk}"
     return redirect(url)
@@ -172,3 +325,26 @@ def delete_trigger(request, pk: int):
 @require_http_methods(("GET",))
 def nothing(request):
     return HttpResponse("")
+
+
+def has_metrics_bearer_token(request) -> bool:
+    token = settings.METRICS_BEARER_TOKEN
+    authorization = request.headers.get("Authorization", "")
+    return bool(token) and hmac.compare_digest(
+        authorization.encode(), f"Bearer {token}".encode()
+    )
+
+
+@require_http_methods(("GET",))
+def metrics(request):
+    # Tells when the household's heating runs, so it isn't public either.
+    # Prometheus can't log in, it sends the bearer token instead.
+    if not request.user.is_authenticated and not has_metrics_bearer_token(request):
+        response = HttpResponse("Unauthorized", status=401)
+        response["WWW-Authenticate"] = "Bearer"
+        return response
+    if get_state_path() is None:
+        raise Http404
+    return HttpResponse(
+        load_metrics().render(), content_type="text/plain; version=0.0.4"
+    )
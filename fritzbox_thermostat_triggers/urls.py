@@ -7,6 +7,7 @@ from fritzbox_thermostat_triggers.triggers import views
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("logs/", views.list_logs, name="list-logs"),
+    path("metrics", views.metrics, name="metrics"),
     path("nothing/", views.nothing),
     path("triggers/", views.list_triggers, name="list-triggers"),
     path("trigger/<int:pk>/card", views.trigger_card),